@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+TickDict 的微基准：原先继承 dict、以 __getattr__/__setattr__ 转发读写的实现（DictTickDict），
+与现在基于 __slots__ 的实现对比构建耗时、属性读取耗时和单个对象占用的内存。
+
+    python benchmarks/data_dict.py [次数]
+"""
+
+import sys
+import timeit
+import tracemalloc
+
+from rqalpha_mod_ctp.ctp.data_dict import TickDict
+from rqalpha_mod_ctp.ctp.tick_recorder import DepthMarketData, STRING_FIELDS, FIELD_NAMES
+from rqalpha_mod_ctp.utils import make_order_book_id, bytes2str
+
+
+class DictTickDict(dict):
+    """
+    改为 __slots__ 之前的 TickDict：所有字段都存放在 dict 中。
+    """
+    _fields = (
+        'order_book_id', 'date', 'time', 'open', 'last', 'low', 'high', 'prev_close', 'volume', 'total_turnover',
+        'open_interest', 'prev_settlement', 'b1', 'b2', 'b3', 'b4', 'b5', 'b1_v', 'b2_v', 'b3_v', 'b4_v', 'b5_v',
+        'a1', 'a2', 'a3', 'a4', 'a5', 'a1_v', 'a2_v', 'a3_v', 'a4_v', 'a5_v', 'limit_down', 'limit_up',
+        'last_volume', 'last_turnover', 'vwap', 'mid', 'spread',
+    )
+
+    def __init__(self, data=None):
+        super(DictTickDict, self).__init__()
+        for name in self._fields:
+            self[name] = None
+        self.is_valid = False
+        if data:
+            self.update_data(data)
+
+    def __getattr__(self, item):
+        return self.__getitem__(item)
+
+    def __setattr__(self, key, value):
+        self.__setitem__(key, value)
+
+    def update_data(self, data):
+        self.order_book_id = make_order_book_id(data.InstrumentID)
+        try:
+            self.date = int(data.TradingDay)
+            self.time = int((bytes2str(data.UpdateTime).replace(':', ''))) * 1000 + int(data.UpdateMillisec)
+            self.open = data.OpenPrice
+            self.last = data.LastPrice
+            self.low = data.LowestPrice
+            self.high = data.HighestPrice
+            self.prev_close = data.PreClosePrice
+            self.volume = data.Volume
+            self.total_turnover = data.Turnover
+            self.open_interest = data.OpenInterest
+            self.prev_settlement = data.SettlementPrice
+
+            self.b1 = data.BidPrice1
+            self.b2 = data.BidPrice2
+            self.b3 = data.BidPrice3
+            self.b4 = data.BidPrice4
+            self.b5 = data.BidPrice5
+            self.b1_v = data.BidVolume1
+            self.b2_v = data.BidVolume2
+            self.b3_v = data.BidVolume3
+            self.b4_v = data.BidVolume4
+            self.b5_v = data.BidVolume5
+            self.a1 = data.AskPrice1
+            self.a2 = data.AskPrice2
+            self.a3 = data.AskPrice3
+            self.a4 = data.AskPrice4
+            self.a5 = data.AskPrice5
+            self.a1_v = data.AskVolume1
+            self.a2_v = data.AskVolume2
+            self.a3_v = data.AskVolume3
+            self.a4_v = data.AskVolume4
+            self.a5_v = data.AskVolume5
+
+            self.limit_up = data.UpperLimitPrice
+            self.limit_down = data.LowerLimitPrice
+            self.is_valid = True
+        except ValueError:
+            self.is_valid = False
+
+
+def make_depth_market_data():
+    fields = dict((name, b'' if name in STRING_FIELDS else 1.0) for name in FIELD_NAMES)
+    fields.update(TradingDay=b'20171101', ActionDay=b'20171031', InstrumentID=b'rb1801', ExchangeID=b'SHFE',
+                  UpdateTime=b'21:00:01', UpdateMillisec=500, Volume=10)
+    return DepthMarketData(**fields)
+
+
+def memory_per_object(cls, data, count=10000):
+    tracemalloc.start()
+    objects = [cls(data) for _ in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+
+def main(number):
+    data = make_depth_market_data()
+    for cls in (DictTickDict, TickDict):
+        construct = min(timeit.repeat(lambda: cls(data), number=number, repeat=3)) / number * 1e6
+        tick = cls(data)
+        access = min(timeit.repeat(lambda: (tick.last, tick.b1, tick.a1, tick.volume), number=number, repeat=3))
+        print('{}: 构建 {:.2f}us，读取 4 个字段 {:.3f}us，每个对象 {:.0f} 字节'.format(
+            cls.__name__, construct, access / number * 1e6, memory_per_object(cls, data)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+tick 时间解码的微基准：原先在 CtpEventSource 中拼接字符串并用 dateutil 解析的做法，与 TickDatetimeDecoder 对比。
+
+    python benchmarks/tick_datetime.py [次数]
+"""
+
+import sys
+import timeit
+from datetime import date, timedelta
+
+from dateutil.parser import parse
+
+from rqalpha_mod_ctp.trading_session import TickDatetimeDecoder
+
+
+def previous_trading_date(d):
+    d -= timedelta(days=1)
+    while d.weekday() >= 5:
+        d -= timedelta(days=1)
+    return d
+
+
+def next_trading_date(d):
+    d += timedelta(days=1)
+    while d.weekday() >= 5:
+        d += timedelta(days=1)
+    return d
+
+
+def parse_with_dateutil(trading_day, tick_time):
+    dt_str = ''.join((str(trading_day), str(float(tick_time) / 1000))) if tick_time >= 100000000 else \
+        '0'.join((str(trading_day), str(float(tick_time) / 1000)))
+    calendar_dt = parse(dt_str.split('.')[0]) + timedelta(milliseconds=100 * int(dt_str.split('.')[1]))
+    if calendar_dt.hour > 20:
+        trading_dt = calendar_dt + timedelta(days=1)
+    else:
+        trading_dt = calendar_dt
+    return calendar_dt, trading_dt
+
+
+def main(number):
+    decoder = TickDatetimeDecoder(previous_trading_date, next_trading_date)
+    cases = [
+        ('日盘', (20170707, 93000500)),
+        ('夜盘（TradingDay）', (20170710, 213000500)),
+        ('夜盘（ActionDay）', (20170710, 213000500, 20170707)),
+    ]
+    baseline = min(timeit.repeat(lambda: parse_with_dateutil(20170707, 93000500), number=number, repeat=3))
+    print('dateutil: %.2fus/tick' % (baseline / number * 1e6))
+    for name, args in cases:
+        elapsed = min(timeit.repeat(lambda: decoder.decode(*args), number=number, repeat=3))
+        print('TickDatetimeDecoder %s: %.2fus/tick（%.1fx）' % (name, elapsed / number * 1e6, baseline / elapsed))
+
+    # 郑商所周五夜盘的 TradingDay 为自然日
+    calendar_dt, trading_dt = decoder.decode(20170707, 213000000, 20170707)
+    assert calendar_dt.date() == date(2017, 7, 7) and trading_dt.date() == date(2017, 7, 10)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -26,10 +26,27 @@ __config__ = {
         "enabled": True,
         "all_day": False,
         "address": "tcp://180.168.212.228:41213",
+        "always_subscribe": [],
+        "batch_size": 1,
+        "batch_wait": 0,
+        "conflate": False,
+        "latency_stats": False,
+        "record_path": None,
+        "replay_path": None,
+        "replay_speed": 1,
+        "clock": "real",
+        "clock_speed": 60,
+        "tick_history": 0,
+        "archive_path": None,
+        "dedup": True,
+        "reconnect_event": False,
+        "lazy_tick": False,
     },
     "trade": {
         "enabled": True,
         "address": "tcp://180.168.146.187:10000",
+        "query_rate": 1,
+        "query_burst": 1,
     },
 }
 
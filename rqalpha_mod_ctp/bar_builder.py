@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .ctp.snapshot_store import is_new_trading_day
+
+
+BAR_DTYPE = np.dtype([
+    ('datetime', '<u8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('total_turnover', '<f8'),
+    ('open_interest', '<f8'),
+    ('limit_up', '<f8'),
+    ('limit_down', '<f8'),
+    ('prev_settlement', '<f8'),
+])
+
+# 分钟线结束后等待迟到 tick 的时间
+BAR_CLOSE_GRACE = timedelta(seconds=3)
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minute_to_datetime(minute):
+    return datetime.fromordinal(minute // MINUTES_PER_DAY) + timedelta(minutes=minute % MINUTES_PER_DAY)
+
+
+def _minute_of(dt):
+    return dt.toordinal() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def _datetime_to_int(dt):
+    return ((((dt.year * 100 + dt.month) * 100 + dt.day) * 100 + dt.hour) * 100 + dt.minute) * 100 + dt.second
+
+
+class BarBuilder(object):
+    """
+    由 tick 增量合成分钟线。
+
+    每个合约占用一个槽位，所有状态保存在预先分配的 (槽位数, 周期数) 数组中，槽位不够时成倍扩容。
+    成交量与成交额由累计值转换为每根 bar 内的增量，交易日切换时重新计算。
+    分钟线以结束时刻标记，集合竞价与收盘时刻的 tick 按交易时段表并入相邻的分钟线。
+    分钟线在下一个 tick 跨入新的 bar 时，或在 bar 结束时刻经过 BAR_CLOSE_GRACE 后由 flush 统一收尾。
+    """
+    def __init__(self, periods=(1, 5, 15), session_table=None, capacity=64):
+        self._periods = np.array(periods, dtype=np.int64)
+        self._frequencies = {'%dm' % p: j for j, p in enumerate(periods)}
+        self._session_table = session_table
+
+        self._slots = {}
+        self._bar_minutes = []
+        n = len(periods)
+        self._bucket = np.full((capacity, n), -1, dtype=np.int64)
+        self._open = np.zeros((capacity, n))
+        self._high = np.zeros((capacity, n))
+        self._low = np.zeros((capacity, n))
+        self._close = np.zeros((capacity, n))
+        self._volume = np.zeros((capacity, n))
+        self._turnover = np.zeros((capacity, n))
+        self._bars = np.zeros((capacity, n), dtype=BAR_DTYPE)
+        self._has_bar = np.zeros((capacity, n), dtype=bool)
+
+        self._trading_day = np.zeros(capacity, dtype=np.int64)
+        self._last_time = np.zeros(capacity, dtype=np.int64)
+        self._cum_volume = np.zeros(capacity)
+        self._cum_turnover = np.zeros(capacity)
+        self._open_interest = np.zeros(capacity)
+        self._limit_up = np.zeros(capacity)
+        self._limit_down = np.zeros(capacity)
+        self._prev_settlement = np.zeros(capacity)
+
+        self._trading_offset = timedelta(0)
+        # 已收尾的 1 分钟线中最晚的结束时刻，以及最近一次产出 bar 事件的时刻，均为分钟序号
+        self._closed_minute = -1
+        self._emitted_minute = -1
+
+    def _grow(self):
+        capacity = len(self._trading_day)
+        for name in ('_bucket', '_open', '_high', '_low', '_close', '_volume', '_turnover', '_bars', '_has_bar',
+                     '_trading_day', '_last_time', '_cum_volume', '_cum_turnover', '_open_interest', '_limit_up', '_limit_down',
+                     '_prev_settlement'):
+            old = getattr(self, name)
+            new = np.zeros((capacity * 2, ) + old.shape[1:], dtype=old.dtype)
+            if name == '_bucket':
+                new.fill(-1)
+            new[:capacity] = old
+            setattr(self, name, new)
+
+    def _slot_of(self, order_book_id):
+        try:
+            return self._slots[order_book_id]
+        except KeyError:
+            slot = len(self._slots)
+            if slot >= len(self._trading_day):
+                self._grow()
+            self._slots[order_book_id] = slot
+            bar_minutes = None
+            if self._session_table is not None:
+                bar_minutes = self._session_table.bar_minutes(order_book_id)
+            self._bar_minutes.append(bar_minutes)
+            return slot
+
+    @property
+    def frequencies(self):
+        return self._frequencies.keys()
+
+    def update(self, tick, calendar_dt, trading_dt):
+        """
+        将一个 tick 合入各周期的 bar。
+        """
+        slot = self._slot_of(tick.order_book_id)
+        self._trading_offset = trading_dt - calendar_dt
+
+        volume = tick.volume
+        turnover = tick.total_turnover
+        if self._trading_day[slot] == 0:
+            # 盘中启动时第一个 tick 的累计成交量属于此前的 bar，只作为起点
+            self._cum_volume[slot] = volume
+            self._cum_turnover[slot] = turnover
+        elif is_new_trading_day(self._trading_day[slot], self._last_time[slot], self._cum_volume[slot],
+                                tick.date, volume):
+            self._cum_volume[slot] = 0
+            self._cum_turnover[slot] = 0
+        self._trading_day[slot] = tick.date
+        self._last_time[slot] = tick.time
+        volume_delta = volume - self._cum_volume[slot]
+        turnover_delta = turnover - self._cum_turnover[slot]
+        self._cum_volume[slot] = volume
+        self._cum_turnover[slot] = turnover
+        self._open_interest[slot] = tick.open_interest
+        self._limit_up[slot] = tick.limit_up
+        self._limit_down[slot] = tick.limit_down
+        self._prev_settlement[slot] = tick.prev_settlement
+
+        minute_of_day = calendar_dt.hour * 60 + calendar_dt.minute
+        bar_minutes = self._bar_minutes[slot]
+        if bar_minutes is not None:
+            minute_of_day = bar_minutes[minute_of_day]
+        minute = calendar_dt.toordinal() * MINUTES_PER_DAY + minute_of_day
+
+        price = tick.last
+        for j in range(len(self._periods)):
+            bucket = minute // self._periods[j]
+            current = self._bucket[slot, j]
+            if current != bucket:
+                if current >= 0:
+                    self._close_bar(slot, j)
+                self._bucket[slot, j] = bucket
+                self._open[slot, j] = self._high[slot, j] = self._low[slot, j] = price
+                self._volume[slot, j] = 0
+                self._turnover[slot, j] = 0
+            elif price > self._high[slot, j]:
+                self._high[slot, j] = price
+            elif price < self._low[slot, j]:
+                self._low[slot, j] = price
+            self._close[slot, j] = price
+            self._volume[slot, j] += volume_delta
+            self._turnover[slot, j] += turnover_delta
+
+    def _close_bar(self, slot, j):
+        bar = self._bars[slot, j]
+        end_minute = (int(self._bucket[slot, j]) + 1) * int(self._periods[j])
+        bar['datetime'] = _datetime_to_int(_minute_to_datetime(end_minute))
+        bar['open'] = self._open[slot, j]
+        bar['high'] = self._high[slot, j]
+        bar['low'] = self._low[slot, j]
+        bar['close'] = self._close[slot, j]
+        bar['volume'] = self._volume[slot, j]
+        bar['total_turnover'] = self._turnover[slot, j]
+        bar['open_interest'] = self._open_interest[slot]
+        bar['limit_up'] = self._limit_up[slot]
+        bar['limit_down'] = self._limit_down[slot]
+        bar['prev_settlement'] = self._prev_settlement[slot]
+        self._has_bar[slot, j] = True
+        self._bucket[slot, j] = -1
+        if j == 0 and end_minute > self._closed_minute:
+            self._closed_minute = end_minute
+
+    def next_flush_time(self):
+        """
+        下一次需要调用 flush 的时刻，没有未收尾的 1 分钟线且没有待产出的 bar 事件时返回 None。
+        """
+        n = len(self._slots)
+        buckets = self._bucket[:n, 0]
+        buckets = buckets[buckets >= 0]
+        candidates = []
+        if len(buckets) > 0:
+            candidates.append((int(buckets.min()) + 1) * int(self._periods[0]))
+        if self._closed_minute > self._emitted_minute:
+            candidates.append(self._closed_minute)
+        if not candidates:
+            return None
+        return _minute_to_datetime(min(candidates)) + BAR_CLOSE_GRACE
+
+    def flush(self, now):
+        """
+        收尾所有在 now 之前已经结束的 bar。
+        若有新的 1 分钟线结束时刻需要产出 bar 事件，返回该时刻 (calendar_dt, trading_dt)，否则返回 None。
+        """
+        n = len(self._slots)
+        now_minute = _minute_of(now - BAR_CLOSE_GRACE)
+        ended = (self._bucket[:n] >= 0) & ((self._bucket[:n] + 1) * self._periods <= now_minute)
+        for slot, j in zip(*np.nonzero(ended)):
+            self._close_bar(slot, j)
+
+        # 提前被下一个 tick 收尾的 bar 也要等到其结束时刻过后才产出事件
+        if self._closed_minute <= self._emitted_minute or self._closed_minute > now_minute:
+            return None
+        self._emitted_minute = self._closed_minute
+        calendar_dt = _minute_to_datetime(self._closed_minute)
+        return calendar_dt, calendar_dt + self._trading_offset
+
+    def get_bar(self, order_book_id, frequency):
+        """
+        返回合约在该周期上最近一根已收尾的 bar（BAR_DTYPE 的一行），没有时返回 None。
+        """
+        j = self._frequencies.get(frequency)
+        slot = self._slots.get(order_book_id)
+        if j is None or slot is None or not self._has_bar[slot, j]:
+            return None
+        return self._bars[slot, j]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from datetime import datetime, timedelta
+
+from .utils import monotonic
+
+
+class RealClock(object):
+    """
+    墙上时钟。
+    """
+    @staticmethod
+    def now():
+        return datetime.now()
+
+    @staticmethod
+    def sleep(seconds):
+        if seconds is not None and seconds > 0:
+            time.sleep(seconds)
+
+    @staticmethod
+    def to_real(seconds):
+        """
+        将时钟上的时长换算为实际需要等待的时长，None 表示无限等待。
+        """
+        return seconds
+
+    @staticmethod
+    def elapse(seconds):
+        """
+        登记一段在时钟之外（如等待行情队列）度过的时长。
+        """
+        pass
+
+
+class AcceleratedClock(object):
+    """
+    从 start 开始、以 speed 倍速流逝的时钟。
+    """
+    def __init__(self, start, speed):
+        self._start = start
+        self._speed = float(speed)
+        self._real_start = monotonic()
+
+    def now(self):
+        return self._start + timedelta(seconds=(monotonic() - self._real_start) * self._speed)
+
+    def sleep(self, seconds):
+        if seconds is not None and seconds > 0:
+            time.sleep(seconds / self._speed)
+
+    def to_real(self, seconds):
+        if seconds is None:
+            return None
+        return seconds / self._speed
+
+    def elapse(self, seconds):
+        pass
+
+
+class SimulatedClock(object):
+    """
+    完全模拟的时钟，只有 sleep/elapse 才会推进时间且不会真正等待，可在数秒内走完整个交易日。
+    """
+    def __init__(self, start, idle_step=60):
+        self._now = start
+        self._idle_step = idle_step
+
+    def now(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.elapse(seconds)
+
+    @staticmethod
+    def to_real(seconds):
+        return 0
+
+    def elapse(self, seconds):
+        if seconds is None:
+            seconds = self._idle_step
+        if seconds > 0:
+            self._now += timedelta(seconds=seconds)
+
+
+def make_clock(name, start=None, speed=1):
+    if name == 'real':
+        return RealClock()
+    if start is None:
+        start = datetime.now()
+    if name == 'accelerated':
+        return AcceleratedClock(start, speed)
+    if name == 'simulated':
+        return SimulatedClock(start)
+    raise ValueError('不支持的时钟类型：{}'.format(name))
@@ -16,12 +16,15 @@
 
 import sys
 from functools import wraps
+from threading import Lock, Event
 
 from rqalpha.const import ORDER_TYPE, SIDE, POSITION_EFFECT
 
 from .pyctp import MdApi, TraderApi, ApiStruct
-from .data_dict import TickDict, PositionDict, AccountDict, InstrumentDict, OrderDict, TradeDict, CommissionDict
-from ..utils import make_order_book_id, str2bytes, bytes2str
+from .query_scheduler import QueryScheduler, QUERY_PRIORITY_ACCOUNT, QUERY_PRIORITY_POSITION, \
+    QUERY_PRIORITY_ORDER, QUERY_PRIORITY_INSTRUMENT, QUERY_PRIORITY_DEPTH_MARKET_DATA, QUERY_PRIORITY_COMMISSION
+from .data_dict import PositionDict, AccountDict, InstrumentDict, OrderDict, TradeDict, CommissionDict
+from ..utils import make_order_book_id, str2bytes, bytes2str, monotonic
 
 ORDER_TYPE_MAPPING = {
     ORDER_TYPE.MARKET: ApiStruct.OPT_AnyPrice,
@@ -40,18 +43,63 @@ POSITION_EFFECT_MAPPING = {
 }
 
 
+# 每次调用 SubscribeMarketData / UnSubscribeMarketData 时传入的最大合约数
+SUBSCRIBE_BATCH_SIZE = 100
+
+
+class QueryFuture(object):
+    """
+    一次查询请求的结果。发出时按 nRequestID 登记，由 query_in_sync 在收到 bIsLast 的回报时完成；
+    ReqQry* 返回流控以外的非零值时立即完成，error 为该返回值。
+    """
+    def __init__(self, key):
+        self.key = key
+        self.req_id = None
+        self.result = None
+        self.error = None
+        self._sent = Event()
+        self._done = Event()
+
+    def set_sent(self):
+        self._sent.set()
+
+    def set_result(self, result):
+        self.result = result
+        self._done.set()
+
+    def set_error(self, error):
+        self.error = error
+        self._sent.set()
+        self._done.set()
+
+    def wait_sent(self, timeout=None):
+        """
+        等待查询离开调度队列被发出（或发送失败），返回是否在超时前发出。
+        """
+        return self._sent.wait(timeout)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        等待查询完成，返回是否在超时前完成。
+        """
+        return self._done.wait(timeout)
+
+
 def query_in_sync(func):
     @wraps(func)
     def wrapper(api, pData, pRspInfo, nRequestID, bIsLast):
         api._req_id = max(api.req_id, nRequestID)
         result = func(api, pData, pRspInfo, nRequestID, bIsLast)
         if bIsLast:
-            api.gateway.on_query(api.api_name, nRequestID, result)
+            api.on_query(nRequestID, result)
     return wrapper
 
 
 class CtpMdApi(MdApi):
-    def __init__(self, gateway, user_id, password, broker_id, address, api_name='ctp_md'):
+    def __init__(self, gateway, user_id, password, broker_id, address, api_name='ctp_md', source=0, flow_path=''):
         super(CtpMdApi, self).__init__()
 
         self.gateway = gateway
@@ -64,6 +112,9 @@ class CtpMdApi(MdApi):
         self.password = password
         self.broker_id = broker_id
         self.address = address
+        # 连接多个行情前置时本前置的序号，以及各前置各自的流文件目录
+        self.source = source
+        self.flow_path = flow_path
 
         self.api_name = api_name
 
@@ -76,7 +127,7 @@ class CtpMdApi(MdApi):
         """服务器断开"""
         self.connected = False
         self.logged_in = False
-        self.gateway.on_debug('服务器断开，将自动重连。')
+        self.gateway.on_disconnected(self, nReason)
 
     def OnHeartBeatWarning(self, nTimeLapse):
         """心跳报警"""
@@ -90,8 +141,10 @@ class CtpMdApi(MdApi):
         """登陆回报"""
         if pRspInfo.ErrorID == 0:
             self.logged_in = True
+            self.gateway.on_login(self)
         else:
             self.gateway.on_err(pRspInfo, sys._getframe().f_code.co_name)
+            self.gateway.on_login_failed(self)
 
     def OnRspUserLogout(self, pUserLogout, pRspInfo, nRequestID, bIsLast):
         """登出回报"""
@@ -110,9 +163,20 @@ class CtpMdApi(MdApi):
 
     def OnRtnDepthMarketData(self, pDepthMarketData):
         """行情推送"""
-        tick_dict = TickDict(pDepthMarketData)
-        if tick_dict.is_valid:
-            self.gateway.on_tick(tick_dict)
+        gateway = self.gateway
+        latency = gateway.latency
+        recv_ts = monotonic() if latency is not None else None
+        recorder = gateway.recorder
+        if recorder is not None:
+            recorder.write(pDepthMarketData)
+        with gateway.tick_lock:
+            if not gateway.accept(pDepthMarketData, self.source):
+                return
+            tick_dict = gateway.tick_class(pDepthMarketData)
+            if tick_dict.is_valid:
+                if latency is not None:
+                    latency.on_receive(tick_dict, recv_ts)
+                gateway.on_tick(tick_dict)
 
     def OnRspSubForQuoteRsp(self, pSpecificInstrument, pRspInfo, nRequestID, bIsLast):
         """订阅期权询价"""
@@ -134,7 +198,7 @@ class CtpMdApi(MdApi):
     def connect(self):
         """初始化连接"""
         if not self.connected:
-            self.Create()
+            self.Create(str2bytes(self.flow_path))
             self.RegisterFront(str2bytes(self.address))
             self.Init()
         else:
@@ -142,9 +206,15 @@ class CtpMdApi(MdApi):
 
     def subscribe(self, ins_id_list):
         """订阅合约"""
-        if len(ins_id_list) > 0:
-            ins_id_list = [str2bytes(i) for i in ins_id_list]
-            self.SubscribeMarketData(ins_id_list)
+        ins_id_list = [str2bytes(i) for i in ins_id_list]
+        for i in range(0, len(ins_id_list), SUBSCRIBE_BATCH_SIZE):
+            self.SubscribeMarketData(ins_id_list[i:i + SUBSCRIBE_BATCH_SIZE])
+
+    def unsubscribe(self, ins_id_list):
+        """退订合约"""
+        ins_id_list = [str2bytes(i) for i in ins_id_list]
+        for i in range(0, len(ins_id_list), SUBSCRIBE_BATCH_SIZE):
+            self.UnSubscribeMarketData(ins_id_list[i:i + SUBSCRIBE_BATCH_SIZE])
 
     def login(self):
         """登录"""
@@ -163,7 +233,8 @@ class CtpMdApi(MdApi):
 
 
 class CtpTdApi(TraderApi):
-    def __init__(self, gateway, user_id, password, broker_id, address, api_name='ctp_td'):
+    def __init__(self, gateway, user_id, password, broker_id, address, api_name='ctp_td', query_rate=1,
+                 query_burst=1):
         super(CtpTdApi, self).__init__()
 
         self.gateway = gateway
@@ -188,6 +259,12 @@ class CtpTdApi(TraderApi):
         self.pos_cache = {}
         self.ins_cache = {}
         self.order_cache = {}
+        self.depth_cache = []
+
+        # 已发出、尚未收到最后一条回报的查询，键为 nRequestID
+        self._query_futures = {}
+        self._query_lock = Lock()
+        self._query_scheduler = QueryScheduler(self._dispatch_query, query_rate, query_burst)
 
         self.api_name = api_name
 
@@ -281,6 +358,14 @@ class CtpTdApi(TraderApi):
         if bIsLast:
             return self.ins_cache
 
+    @query_in_sync
+    def OnRspQryDepthMarketData(self, pDepthMarketData, pRspInfo, nRequestID, bIsLast):
+        """行情查询回报"""
+        if pDepthMarketData and pDepthMarketData.InstrumentID:
+            self.depth_cache.append(pDepthMarketData)
+        if bIsLast:
+            return self.depth_cache
+
     def OnRspError(self, pRspInfo, nRequestID, bIsLast):
         """错误回报"""
         self.gateway.on_err(pRspInfo, sys._getframe().f_code.co_name)
@@ -312,6 +397,43 @@ class CtpTdApi(TraderApi):
         self._req_id += 1
         return self._req_id
 
+    def on_query(self, req_id, result):
+        with self._query_lock:
+            future = self._query_futures.pop(req_id, None)
+        if future is not None:
+            self._query_scheduler.done(future.key, future)
+            future.set_result(result)
+
+    def cancel_query(self, future):
+        """
+        放弃等待一个查询，之后的回报会被忽略，相同的查询可以重新提交。
+        """
+        with self._query_lock:
+            if self._query_futures.get(future.req_id) is future:
+                del self._query_futures[future.req_id]
+        self._query_scheduler.done(future.key, future)
+
+    def _send_query(self, key, priority, send):
+        return self._query_scheduler.submit(key, priority, send, QueryFuture(key))
+
+    def _dispatch_query(self, send, future):
+        # 先登记再发送，回报不会早于登记到达
+        with self._query_lock:
+            req_id = future.req_id = self.req_id
+            self._query_futures[req_id] = future
+        try:
+            ret = send(req_id)
+        except Exception:
+            with self._query_lock:
+                self._query_futures.pop(req_id, None)
+            raise
+        if ret:
+            with self._query_lock:
+                self._query_futures.pop(req_id, None)
+        else:
+            future.set_sent()
+        return ret
+
     def connect(self):
         if not self.connected:
             self.Create()
@@ -358,11 +480,10 @@ class CtpTdApi(TraderApi):
         self.ReqSettlementInfoConfirm(req, req_id)
 
     def qryInstrument(self):
-        self.ins_cache = {}
-        req = ApiStruct.QryInstrument()
-        req_id = self.req_id
-        self.ReqQryInstrument(req, req_id)
-        return req_id
+        def send(req_id):
+            self.ins_cache = {}
+            return self.ReqQryInstrument(ApiStruct.QryInstrument(), req_id)
+        return self._send_query('instrument', QUERY_PRIORITY_INSTRUMENT, send)
 
     def qryCommission(self, order_book_id):
         ins_dict = self.gateway.get_ins_dict(order_book_id)
@@ -373,35 +494,40 @@ class CtpTdApi(TraderApi):
             InvestorID=str2bytes(self.user_id),
             BrokerID=str2bytes(self.broker_id),
         )
-        req_id = self.req_id
-        self.ReqQryInstrumentCommissionRate(req, req_id)
-        return req_id
+        return self._send_query(('commission', order_book_id), QUERY_PRIORITY_COMMISSION,
+                                lambda req_id: self.ReqQryInstrumentCommissionRate(req, req_id))
 
     def qryAccount(self):
         req = ApiStruct.QryTradingAccount()
-        req_id = self.req_id
-        self.ReqQryTradingAccount(req, req_id)
-        return req_id
+        return self._send_query('account', QUERY_PRIORITY_ACCOUNT, lambda req_id: self.ReqQryTradingAccount(req, req_id))
 
     def qryPosition(self):
-        self.pos_cache = {}
         req = ApiStruct.QryInvestorPosition(
             BrokerID=str2bytes(self.broker_id),
             InvestorID=str2bytes(self.user_id)
         )
-        req_id = self.req_id
-        self.ReqQryInvestorPosition(req, req_id)
-        return req_id
+
+        def send(req_id):
+            self.pos_cache = {}
+            return self.ReqQryInvestorPosition(req, req_id)
+        return self._send_query('position', QUERY_PRIORITY_POSITION, send)
 
     def qryOrder(self):
-        self.order_cache = {}
         req = ApiStruct.QryOrder(
             BrokerID=str2bytes(self.broker_id),
             InvestorID=str2bytes(self.user_id)
         )
-        req_id = self.req_id
-        self.ReqQryOrder(req, req_id)
-        return req_id
+
+        def send(req_id):
+            self.order_cache = {}
+            return self.ReqQryOrder(req, req_id)
+        return self._send_query('order', QUERY_PRIORITY_ORDER, send)
+
+    def qryDepthMarketData(self):
+        def send(req_id):
+            self.depth_cache = []
+            return self.ReqQryDepthMarketData(ApiStruct.QryDepthMarketData(), req_id)
+        return self._send_query('depth_market_data', QUERY_PRIORITY_DEPTH_MARKET_DATA, send)
 
     def sendOrder(self, order):
         ins_dict = self.gateway.get_ins_dict(order.order_book_id)
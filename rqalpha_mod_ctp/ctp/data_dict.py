@@ -15,12 +15,14 @@
 # limitations under the License.
 
 import numpy as np
+from six import with_metaclass
 
 from rqalpha.const import SIDE, POSITION_EFFECT, ORDER_STATUS, COMMISSION_TYPE, MARGIN_TYPE
 from rqalpha.model.order import LimitOrder
 
 from ..utils import make_order_book_id, make_underlying_symbol, is_future, bytes2str
 from .pyctp import ApiStruct
+from .snapshot_store import SNAPSHOT_FIELDS
 
 
 SIDE_REVERSE = {
@@ -29,68 +31,108 @@ SIDE_REVERSE = {
 }
 
 
-class DataDict(dict):
+class _DataDictMeta(type):
+    """
+    将类体中声明的 _fields 追加到 __slots__，并与基类的字段合并。
+    """
+    def __new__(mcs, name, bases, namespace):
+        fields = tuple(namespace.pop('_fields', ()))
+        namespace['__slots__'] = tuple(namespace.get('__slots__', ())) + fields
+        cls = super(_DataDictMeta, mcs).__new__(mcs, name, bases, namespace)
+        cls._fields = tuple(f for base in bases for f in getattr(base, '_fields', ())) + fields
+        cls._field_set = frozenset(cls._fields)
+        return cls
+
+
+class DataDict(with_metaclass(_DataDictMeta, object)):
+    """
+    CTP 数据记录的基类。字段在子类的 _fields 中声明并存放在 __slots__ 里，实例没有 __dict__，
+    构造和读写字段都不经过 dict。未赋值的字段读出为 None。
+
+    保留了按下标、keys/items/get/update 访问字段的 dict 接口；RqAttrDict 等需要真正 dict 的地方使用 as_dict。
+    """
     def __init__(self, d=None):
         if d:
-            super(DataDict, self).__init__(d)
-        else:
-            super(DataDict, self).__init__()
-
-    def copy(self):
-        return DataDict(super(DataDict, self).copy())
+            self.update(d)
 
     def __getattr__(self, item):
-        return self.__getitem__(item)
+        if item in self._field_set:
+            return None
+        raise AttributeError(item)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._field_set:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._field_set
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key)
+        return default
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return [getattr(self, key) for key in self._fields]
 
-    def __setattr__(self, key, value):
-        self.__setitem__(key, value)
+    def items(self):
+        return [(key, getattr(self, key)) for key in self._fields]
+
+    def update(self, other=(), **kwargs):
+        if hasattr(other, 'keys'):
+            other = ((key, other[key]) for key in other.keys())
+        for key, value in other:
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def copy(self):
+        other = object.__new__(self.__class__)
+        for key in self._fields:
+            try:
+                setattr(other, key, object.__getattribute__(self, key))
+            except AttributeError:
+                pass
+        return other
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self._fields}
 
 
 class TickDict(DataDict):
-    def __init__(self, data=None):
-        super(TickDict, self).__init__()
-        self.order_book_id = None
-        self.date = None
-        self.time = None
-        self.open = None
-        self.last = None
-        self.low = None
-        self.high = None
-        self.prev_close = None
-        self.volume = None
-        self.total_turnover = None
-        self.open_interest = None
-        self.prev_settlement = None
-
-        self.b1 = None
-        self.b2 = None
-        self.b3 = None
-        self.b4 = None
-        self.b5 = None
-
-        self.b1_v = None
-        self.b2_v = None
-        self.b3_v = None
-        self.b4_v = None
-        self.b5_v = None
-
-        self.a1 = None
-        self.a2 = None
-        self.a3 = None
-        self.a4 = None
-        self.a5 = None
-
-        self.a1_v = None
-        self.a2_v = None
-        self.a3_v = None
-        self.a4_v = None
-        self.a5_v = None
-
-        self.limit_down = None
-        self.limit_up = None
+    _fields = (
+        'order_book_id', 'date', 'time', 'action_day', 'open', 'last', 'low', 'high', 'prev_close', 'volume', 'total_turnover',
+        'open_interest', 'prev_settlement',
+        'b1', 'b2', 'b3', 'b4', 'b5', 'b1_v', 'b2_v', 'b3_v', 'b4_v', 'b5_v',
+        'a1', 'a2', 'a3', 'a4', 'a5', 'a1_v', 'a2_v', 'a3_v', 'a4_v', 'a5_v',
+        'limit_down', 'limit_up',
+        # 由 MdGateway 根据上一笔快照推算
+        'last_volume', 'last_turnover', 'vwap', 'mid', 'spread',
+        'is_valid',
+    )
+    # TickLatencyTracker 记录的时间戳，不属于 tick 数据
+    __slots__ = ('_recv_ts', '_enqueue_ts', '_dispatch_ts')
 
+    def __init__(self, data=None):
         self.is_valid = False
-
         if data:
             self.update_data(data)
 
@@ -99,6 +141,7 @@ class TickDict(DataDict):
         try:
             self.date = int(data.TradingDay)
             self.time = int((bytes2str(data.UpdateTime).replace(':', ''))) * 1000 + int(data.UpdateMillisec)
+            self.action_day = _decode_action_day(data)
             self.open = data.OpenPrice
             self.last = data.LastPrice
             self.low = data.LowestPrice
@@ -137,6 +180,60 @@ class TickDict(DataDict):
             self.is_valid = False
 
 
+def _decode_action_day(data):
+    # 部分柜台不填写 ActionDay
+    try:
+        return int(data.ActionDay)
+    except (ValueError, TypeError):
+        return None
+
+
+def _decode_time(data):
+    return int((bytes2str(data.UpdateTime).replace(':', ''))) * 1000 + int(data.UpdateMillisec)
+
+
+def _raw_field_decoder(raw_name):
+    return lambda data: getattr(data, raw_name)
+
+
+_TICK_DECODERS = {name: _raw_field_decoder(raw_name) for name, _, raw_name in SNAPSHOT_FIELDS[2:]}
+_TICK_DECODERS['order_book_id'] = lambda data: make_order_book_id(data.InstrumentID)
+_TICK_DECODERS['action_day'] = _decode_action_day
+
+
+class LazyTickDict(TickDict):
+    """
+    与 TickDict 字段相同，但只持有原始的 DepthMarketData，各字段在第一次读取时才解码并缓存。
+    策略通常只读取 last、b1/a1、volume 等少数字段，其余字段不会被解码。
+
+    date 与 time 在过滤、延迟统计和构建事件时总会用到，并决定 is_valid，因此在构造时解码。
+    """
+    __slots__ = ('raw', )
+
+    def __init__(self, data):
+        self.raw = data
+        try:
+            self.date = int(data.TradingDay)
+            self.time = _decode_time(data)
+            self.is_valid = True
+        except ValueError:
+            self.is_valid = False
+
+    def __getattr__(self, item):
+        try:
+            decode = _TICK_DECODERS[item]
+        except KeyError:
+            return super(LazyTickDict, self).__getattr__(item)
+        value = decode(self.raw)
+        setattr(self, item, value)
+        return value
+
+    def copy(self):
+        other = super(LazyTickDict, self).copy()
+        other.raw = self.raw
+        return other
+
+
 # 由持仓构建的伪 tick 类，用于在拿不到行情的时候提供 last_board 。
 class FakeTickDict(TickDict):
     def __init__(self, pos_dict):
@@ -150,9 +247,14 @@ class FakeTickDict(TickDict):
 
 
 class PositionDict(DataDict):
-    def __init__(self, data, ins_dict=None):
+    _fields = (
+        'order_book_id', 'buy_old_quantity', 'buy_quantity', 'buy_today_quantity', 'buy_transaction_cost',
+        'buy_realized_pnl', 'buy_avg_open_price', 'sell_old_quantity', 'sell_quantity', 'sell_today_quantity',
+        'sell_transaction_cost', 'sell_realized_pnl', 'sell_avg_open_price', 'prev_settle_price',
+        'buy_open_cost', 'sell_open_cost', 'contract_multiplier', 'is_valid',
+    )
 
-        super(PositionDict, self).__init__()
+    def __init__(self, data, ins_dict=None):
         self.order_book_id = make_order_book_id(data.InstrumentID)
         self.buy_old_quantity = 0
         self.buy_quantity = 0
@@ -213,23 +315,19 @@ class PositionDict(DataDict):
 
 
 class AccountDict(DataDict):
+    _fields = ('yesterday_portfolio_value', )
+
     def __init__(self, data):
-        super(AccountDict, self).__init__()
         self.yesterday_portfolio_value = data.PreBalance
 
 
 class InstrumentDict(DataDict):
-    def __init__(self, data):
-        super(InstrumentDict, self).__init__()
-        self.order_book_id = None
-        self.underlying_symbol = None
-        self.exchange_id = None
-        self.contract_multiplier = None
-        self.long_margin_ratio = None
-        self.short_margin_ratio = None
-        self.margin_type = None
-        self.instrument_id = None
+    _fields = (
+        'order_book_id', 'underlying_symbol', 'exchange_id', 'contract_multiplier', 'long_margin_ratio',
+        'short_margin_ratio', 'margin_type', 'instrument_id', 'is_valid',
+    )
 
+    def __init__(self, data):
         self.is_valid = False
 
         self.update_data(data)
@@ -238,7 +336,7 @@ class InstrumentDict(DataDict):
         if is_future(data.InstrumentID):
             self.order_book_id = make_order_book_id(data.InstrumentID)
             self.underlying_symbol = make_underlying_symbol(data.InstrumentID)
-            self.exchange_id = data.ExchangeID
+            self.exchange_id = bytes2str(data.ExchangeID)
             self.contract_multiplier = data.VolumeMultiple
             self.long_margin_ratio = data.LongMarginRatio
             self.short_margin_ratio = data.ShortMarginRatio
@@ -250,14 +348,9 @@ class InstrumentDict(DataDict):
 
 
 class CommissionDict(DataDict):
-    def __init__(self, data):
-        super(CommissionDict, self).__init__()
-        self.underlying_symbol = None
-        self.close_ratio = None
-        self.open_ratio = None
-        self.close_today_ratio = None
-        self.commission_type = None
+    _fields = ('underlying_symbol', 'close_ratio', 'open_ratio', 'close_today_ratio', 'commission_type', 'is_valid')
 
+    def __init__(self, data):
         self.is_valid = False
         if data is not None:
             self.update_data(data)
@@ -284,23 +377,13 @@ class CommissionDict(DataDict):
 
 
 class OrderDict(DataDict):
+    _fields = (
+        'order_id', 'order_book_id', 'front_id', 'session_id', 'exchange_id',
+        'quantity', 'filled_quantity', 'unfilled_quantity', 'side', 'price', 'position_effect', 'status',
+        'style', 'is_valid',
+    )
+
     def __init__(self, data, rejected=False):
-        super(OrderDict, self).__init__()
-        self.order_id = None
-        self.order_book_id = None
-        self.front_id = None
-        self.session_id = None
-        self.exchange_id = None
-
-        self.quantity = None
-        self.filled_quantity = None
-        self.unfilled_quantity = None
-        self.side = None
-        self.price = None
-        self.position_effect = None
-        self.status = None
-
-        self.style = None
         self.is_valid = False
 
         self.update_data(data, rejected)
@@ -370,21 +453,13 @@ class OrderDict(DataDict):
 
 
 class TradeDict(DataDict):
-    def __init__(self, data):
-        super(TradeDict, self).__init__()
-        self.order_id = None
-        self.trade_id = None
-        self.order_book_id = None
-
-        self.side = None
-        self.exchange_id = None
-        self.position_effect = None
-        self.quantity = None
-        self.style = None
-        self.price = None
+    _fields = (
+        'order_id', 'trade_id', 'order_book_id', 'side', 'exchange_id', 'position_effect', 'quantity', 'style',
+        'price', 'is_valid',
+    )
 
+    def __init__(self, data):
         self.is_valid = False
-        
         self.update_data(data)
 
     def update_data(self, data):
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from threading import Lock
+
+from ..utils import monotonic
+
+
+# 每个数量级（2 的幂）内的子桶数为 2 ** SUB_BUCKET_BITS，相对误差不超过 1 / 2 ** (SUB_BUCKET_BITS - 1)
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKET_COUNT = SUB_BUCKET_COUNT >> 1
+# 最大可记录约 2 ** 40 微秒（约 12 天），超出的值计入最后一个桶
+MAX_MAGNITUDE = 40 - SUB_BUCKET_BITS
+BUCKET_COUNT = (MAX_MAGNITUDE + 2) * HALF_SUB_BUCKET_COUNT
+
+STAGES = ('exchange_to_callback', 'callback_to_enqueue', 'enqueue_to_dispatch', 'handler')
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket_index(value):
+    if value < SUB_BUCKET_COUNT:
+        return value if value > 0 else 0
+    magnitude = value.bit_length() - SUB_BUCKET_BITS
+    if magnitude > MAX_MAGNITUDE:
+        return BUCKET_COUNT - 1
+    return magnitude * HALF_SUB_BUCKET_COUNT + (value >> magnitude)
+
+
+def _bucket_value(index):
+    if index < SUB_BUCKET_COUNT:
+        return index
+    magnitude = index // HALF_SUB_BUCKET_COUNT - 1
+    return (index - magnitude * HALF_SUB_BUCKET_COUNT) << magnitude
+
+
+class LatencyHistogram(object):
+    """
+    HDR 风格的对数线性直方图，以微秒为单位记录延迟，记录一次只需一次位运算和一次列表写入。
+    """
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total = 0
+        self.max = 0
+
+    def record(self, micros):
+        micros = int(micros)
+        self.counts[_bucket_index(micros)] += 1
+        self.total += 1
+        if micros > self.max:
+            self.max = micros
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if self.total == 0:
+            return 0
+        target = self.total * p / 100.
+        cum = 0
+        for index, count in enumerate(self.counts):
+            cum += count
+            if count and cum >= target:
+                return min(_bucket_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        result = {'count': self.total, 'max': self.max}
+        for p in PERCENTILES:
+            result['p%s' % p] = self.percentile(p)
+        return result
+
+
+class RollingLatencyHistogram(object):
+    """
+    滚动窗口直方图，统计最近一到两个窗口内的数据。多个前置的行情回调线程会同时记录，因此记录和读取都需加锁。
+    """
+    def __init__(self, window):
+        self._window = window
+        self._window_start = monotonic()
+        self._current = LatencyHistogram()
+        self._previous = LatencyHistogram()
+        self._lock = Lock()
+
+    def record(self, micros, now):
+        with self._lock:
+            if now - self._window_start >= self._window:
+                self._previous = self._current
+                self._current = LatencyHistogram()
+                self._window_start = now
+            self._current.record(micros)
+
+    def snapshot(self):
+        histogram = LatencyHistogram()
+        with self._lock:
+            histogram.merge(self._previous)
+            histogram.merge(self._current)
+        return histogram
+
+
+class TickLatencyTracker(object):
+    """
+    tick 端到端延迟统计，分为四个阶段：
+
+        exchange_to_callback: 交易所 UpdateTime/UpdateMillisec 到 OnRtnDepthMarketData 回调（墙上时钟，含本地与交易所的时钟偏差）
+        callback_to_enqueue: 回调到 MdGateway.on_tick 放入队列
+        enqueue_to_dispatch: 放入队列到 CtpEventSource.events 产出事件
+        handler: 产出事件到事件处理完毕（即生成器被再次唤醒）
+
+    各时间戳以 TickDict 的私有 slot 记录，不会出现在策略拿到的 tick 数据中。
+    exchange_to_callback 与 callback_to_enqueue 在每个前置的回调线程中记录，由 RollingLatencyHistogram 加锁保护。
+    """
+    def __init__(self, window=60):
+        self._histograms = {stage: RollingLatencyHistogram(window) for stage in STAGES}
+        self._utc_offset = -(time.altzone if time.daylight and time.localtime().tm_isdst else time.timezone)
+
+    def on_receive(self, tick_dict, recv_ts):
+        wall_ms = int((time.time() + self._utc_offset) % 86400 * 1000)
+        tick_time = tick_dict.time
+        exchange_ms = ((tick_time // 10000000 * 60 + tick_time // 100000 % 100) * 60 + tick_time // 1000 % 100) * 1000 \
+            + tick_time % 1000
+        delay_ms = (wall_ms - exchange_ms) % 86400000
+        if delay_ms > 43200000:
+            # 本地时钟慢于交易所
+            delay_ms -= 86400000
+        self._histograms['exchange_to_callback'].record(max(delay_ms, 0) * 1000, recv_ts)
+        object.__setattr__(tick_dict, '_recv_ts', recv_ts)
+
+    def on_enqueue(self, tick_dict):
+        now = monotonic()
+        object.__setattr__(tick_dict, '_enqueue_ts', now)
+        recv_ts = getattr(tick_dict, '_recv_ts', None)
+        if recv_ts is not None:
+            self._histograms['callback_to_enqueue'].record((now - recv_ts) * 1e6, now)
+
+    def on_dispatch(self, tick_dict):
+        now = monotonic()
+        object.__setattr__(tick_dict, '_dispatch_ts', now)
+        enqueue_ts = getattr(tick_dict, '_enqueue_ts', None)
+        if enqueue_ts is not None:
+            self._histograms['enqueue_to_dispatch'].record((now - enqueue_ts) * 1e6, now)
+
+    def on_handled(self, tick_dict):
+        now = monotonic()
+        dispatch_ts = getattr(tick_dict, '_dispatch_ts', None)
+        if dispatch_ts is not None:
+            self._histograms['handler'].record((now - dispatch_ts) * 1e6, now)
+
+    def summary(self):
+        """
+        返回各阶段延迟的统计，单位为微秒。
+        """
+        return {stage: self._histograms[stage].snapshot().summary() for stage in STAGES}
+
+    def format_summary(self):
+        lines = []
+        summary = self.summary()
+        for stage in STAGES:
+            s = summary[stage]
+            lines.append('%s: count=%d p50=%dus p90=%dus p99=%dus p99.9=%dus max=%dus' % (
+                stage, s['count'], s['p50'], s['p90'], s['p99'], s['p99.9'], s['max']))
+        return '\n'.join(lines)
@@ -13,71 +13,398 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import tempfile
 from time import sleep
+from collections import deque
+from datetime import datetime
+from threading import Thread, Lock, Timer
+from six import iteritems, string_types
 try:
     from Queue import Queue, Empty
 except ImportError:
     from queue import Queue, Empty
 
 from rqalpha.utils.logger import system_log
-from rqalpha.environment import Environment
 from rqalpha.events import EVENT
 
 from .api import CtpMdApi
+from .data_dict import TickDict, LazyTickDict
+from .tick_queue import ConflatingTickQueue
+from .snapshot_store import SnapshotStore, tick_record, raw_record, INVALID_PRICE, DERIVED_FIELD_NAMES
+from .tick_archive import TickArchiveWriter
+from .tick_history import TickHistory
+from .tick_guard import TickSequenceGuard
+from .tick_recorder import TickRecorder, read_ticks
+from .latency import TickLatencyTracker
+from ..utils import monotonic, symbol_registry, bytes2str
+
+
+# rqalpha 的交易所代码到 CTP 交易所代码
+_CTP_EXCHANGE_IDS = {'XSGE': 'SHFE', 'XDCE': 'DCE', 'XZCE': 'CZCE', 'CCFX': 'CFFEX', 'XINE': 'INE'}
 
 
 class MdGateway(object):
-    def __init__(self, env, retry_times=5, retry_interval=1):
+    def __init__(self, env, retry_times=5, retry_interval=1, conflate=False, latency_stats=False, record_path=None,
+                 always_subscribe=None, tick_history=0, archive_path=None, dedup=True,
+                 reconnect_event=False, lazy_tick=False):
         self._env = env
 
-        self._md_api = None
+        self._md_apis = []
+        self._multi_front = False
+        # 多个前置的行情回调线程并发到达，过滤、去重和入队需串行执行
+        self.tick_lock = Lock()
 
         self._retry_times = retry_times
         self._retry_interval = retry_interval
 
-        self._snapshot_cache = {}
-        self._tick_que = Queue()
-        self.subscribed = []
+        self._snapshot_store = SnapshotStore()
+        self._tick_que = ConflatingTickQueue() if conflate else Queue()
+        self.latency = TickLatencyTracker() if latency_stats else None
+        self.recorder = TickRecorder(record_path) if record_path else None
+        self.tick_history = TickHistory(tick_history) if tick_history > 0 else None
+        self.archive = TickArchiveWriter(archive_path) if archive_path else None
+        self._sequence_guard = TickSequenceGuard() if dedup else None
+        # 行情回调用来构建 tick 的类
+        self.tick_class = LazyTickDict if lazy_tick else TickDict
+        self._lazy_tick = lazy_tick
+        self.subscribed = set()
+        # 订阅合约的原始合约代码，行情回调据此在构建 TickDict 之前过滤
+        self.wanted_ids = frozenset()
+        # 不在 universe 中也始终订阅的合约（配置的常驻合约与当前持仓合约），以及当前已向行情前置订阅的原始合约代码
+        self._always_subscribe = set(always_subscribe or ())
+        self._position_ids = frozenset()
+        self._md_subscribed = set()
+        self._subscribe_lock = Lock()
+        self._wanted_lock = Lock()
+
+        # 断线统计：所有前置全部断开的时刻，最近的断线记录，以及等待重连后第一笔行情来计算成交量跳变的合约
+        self.disconnects = 0
+        self.gaps = deque(maxlen=100)
+        self._down_since = None
+        self._gap_pending = {}
+        self._gap_events = deque() if reconnect_event else None
 
     def connect(self, user_id, password, broker_id, md_address):
-        self._md_api = CtpMdApi(self, user_id, password, broker_id, md_address)
+        addresses = [md_address] if isinstance(md_address, string_types) else list(md_address)
+        self._multi_front = len(addresses) > 1
+        if self._multi_front and self._sequence_guard is None:
+            # 多个前置会送达同一笔行情，必须去重
+            self._sequence_guard = TickSequenceGuard()
+        self._md_apis = [
+            CtpMdApi(self, user_id, password, broker_id, address, source=i, flow_path=self._flow_path(i))
+            for i, address in enumerate(addresses)
+        ]
 
         for i in range(self._retry_times):
-            self._md_api.connect()
+            for md_api in self._md_apis:
+                md_api.connect()
             sleep(self._retry_interval * (i+1))
-            if self._md_api.logged_in:
-                self.on_log('CTP 行情服务器登录成功')
+            logged_in = [md_api.address for md_api in self._md_apis if md_api.logged_in]
+            if logged_in:
+                self.on_log('CTP 行情服务器登录成功：{}'.format(', '.join(logged_in)))
                 break
         else:
             raise RuntimeError('CTP 行情服务器连接或登录超时')
 
-        self._md_api.subscribe([ins_dict.instrument_id for ins_dict in Environment.get_ins_dict().values()])
+        self._sync_subscriptions()
 
         self.on_log('数据同步完成。')
 
         self._env.event_bus.add_listener(EVENT.POST_UNIVERSE_CHANGED, self.on_universe_changed)
+        self._env.event_bus.add_listener(EVENT.POST_SYSTEM_INIT, self.on_positions_changed)
+        self._env.event_bus.add_listener(EVENT.TRADE, self.on_positions_changed)
+
+    @staticmethod
+    def _flow_path(source):
+        flow_path = os.path.join(tempfile.gettempdir(), 'rqalpha_mod_ctp', 'md_{}'.format(source), '')
+        if not os.path.isdir(flow_path):
+            os.makedirs(flow_path)
+        return flow_path
 
-    def get_tick(self):
+    def get_tick(self, timeout=None):
+        """
+        获取下一个 tick。指定 timeout 时，超时后返回 None，否则一直阻塞直至拿到 tick。
+        """
+        if timeout is not None:
+            try:
+                return self._tick_que.get(block=True, timeout=timeout)
+            except Empty:
+                return None
         while True:
             try:
                 return self._tick_que.get(block=True, timeout=1)
             except Empty:
                 self.on_debug('Get tick timeout.')
 
+    def get_ticks(self, max_count, timeout=None, max_wait=0):
+        """
+        一次取出队列中积压的 tick，最多 max_count 个。拿到第一个 tick 后，若队列已空，最多再等待 max_wait 秒以凑满一批。
+        timeout 的含义与 get_tick 相同，超时返回空列表。
+        """
+        tick = self.get_tick(timeout)
+        if tick is None:
+            return []
+        ticks = [tick]
+        deadline = None
+        while len(ticks) < max_count:
+            try:
+                ticks.append(self._tick_que.get_nowait())
+            except Empty:
+                if max_wait <= 0:
+                    break
+                if deadline is None:
+                    deadline = monotonic() + max_wait
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    ticks.append(self._tick_que.get(block=True, timeout=remaining))
+                except Empty:
+                    break
+        return ticks
+
+    def pending_ticks(self):
+        return self._tick_que.qsize()
+
     def exit(self):
-        self._md_api.close()
+        for md_api in self._md_apis:
+            md_api.close()
+        self._close_writers()
+
+    def _close_writers(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.archive is not None:
+            self.archive.close()
 
     @property
     def snapshot(self):
-        return self._snapshot_cache
+        return self._snapshot_store
+
+    @property
+    def dropped_ticks(self):
+        """
+        合并行情模式下各合约被较新 tick 覆盖而丢弃的 tick 数量。
+        """
+        return dict(getattr(self._tick_que, 'dropped', {}))
+
+    @property
+    def rejected_ticks(self):
+        """
+        各合约因重复或乱序而被丢弃的行情数量，为 {'duplicates': {...}, 'regressions': {...}}。
+        """
+        guard = self._sequence_guard
+        if guard is None:
+            return {'duplicates': {}, 'regressions': {}}
+        return {
+            name: {
+                symbol_registry.lookup(k).order_book_id or bytes2str(k): v for k, v in iteritems(getattr(guard, name))
+            } for name in ('duplicates', 'regressions')
+        }
+
+    @property
+    def front_stats(self):
+        """
+        各行情前置的连接状态，以及同一笔行情由该前置最先送达的次数和平均领先时间（毫秒）。
+        """
+        guard = self._sequence_guard
+        stats = []
+        for md_api in self._md_apis:
+            lead_count = guard.lead_count[md_api.source] if guard is not None else 0
+            lead_time = guard.lead_time[md_api.source] if guard is not None else 0
+            stats.append({
+                'address': md_api.address,
+                'logged_in': md_api.logged_in,
+                'lead_count': lead_count,
+                'avg_lead_ms': lead_time * 1000 / lead_count if lead_count else 0,
+            })
+        return stats
+
+    def _turnover_unit(self, order_book_id):
+        """
+        CTP 行情中的成交额：郑商所为 价格 * 成交量，其他交易所还要乘以合约乘数。
+        """
+        info = symbol_registry.get(order_book_id)
+        if info is None:
+            return float('nan')
+        if info.exchange_id is None:
+            # 未由 TradeGateway 登记的合约，从 rqalpha 的合约信息补全后登记
+            try:
+                instrument = self._env.get_instrument(order_book_id)
+                info = symbol_registry.register(
+                    info.instrument_id, order_book_id, info.underlying_symbol,
+                    _CTP_EXCHANGE_IDS.get(instrument.exchange, instrument.exchange), instrument.contract_multiplier
+                )
+            except (AttributeError, KeyError, ValueError):
+                return float('nan')
+        return 1 if info.exchange_id == 'CZCE' else info.contract_multiplier
+
+    def accept(self, data, source=0):
+        """
+        按原始合约代码过滤行情，返回是否需要为其构建 TickDict。重复或乱序的行情直接丢弃，未订阅合约的行情只更新快照。
+        """
+        guard = self._sequence_guard
+        if guard is not None and not guard.check(data, source, monotonic() if self._multi_front else None):
+            return False
+        instrument_id = data.InstrumentID
+        if instrument_id in self.wanted_ids:
+            return True
+        order_book_id = symbol_registry.lookup(instrument_id).order_book_id
+        if order_book_id in self.subscribed:
+            # 订阅时尚未登记的合约，收到第一笔行情后加入过滤集合
+            with self._wanted_lock:
+                self.wanted_ids = self.wanted_ids | {instrument_id}
+            return True
+        if order_book_id is not None:
+            record = raw_record(data)
+            if record is not None:
+                record = self._snapshot_store.update(order_book_id, record, self._turnover_unit(order_book_id))
+                if self.archive is not None:
+                    self.archive.write(order_book_id, record)
+        return False
+
+    def seed_snapshot(self, depth_market_data):
+        """
+        用查询得到的行情预填快照，已经收到推送的合约不会被覆盖。无效价格（CTP 以 DBL_MAX 表示）记为 nan。
+        """
+        seeded = 0
+        for data in depth_market_data:
+            order_book_id = symbol_registry.lookup(data.InstrumentID).order_book_id
+            if order_book_id is None or order_book_id in self._snapshot_store:
+                continue
+            record = raw_record(data)
+            if record is None:
+                continue
+            self._snapshot_store.update(order_book_id, tuple(
+                float('nan') if isinstance(value, float) and value > INVALID_PRICE else value for value in record
+            ), self._turnover_unit(order_book_id))
+            seeded += 1
+        self.on_debug('由行情查询预填 {} 个合约的快照。'.format(seeded))
 
     def on_tick(self, tick_dict):
-        if tick_dict.order_book_id in self.subscribed:
-            self._tick_que.put(tick_dict)
-        self._snapshot_cache[tick_dict.order_book_id] = tick_dict
+        order_book_id = tick_dict.order_book_id
+        # LazyTickDict 直接从原始行情生成快照记录，不必逐个字段解码
+        base_record = raw_record(tick_dict.raw) if self._lazy_tick else tick_record(tick_dict)
+        record = self._snapshot_store.update(order_book_id, base_record, self._turnover_unit(order_book_id))
+        tick_dict.update(zip(DERIVED_FIELD_NAMES, record[-len(DERIVED_FIELD_NAMES):]))
+        if self._gap_pending:
+            gap = self._gap_pending.pop(order_book_id, None)
+            if gap is not None:
+                gap['missed_volume'][order_book_id] = tick_dict.last_volume
+        if self.latency is not None:
+            self.latency.on_enqueue(tick_dict)
+        self._tick_que.put(tick_dict)
+        if self.archive is not None:
+            self.archive.write(order_book_id, record)
+        if self.tick_history is not None:
+            self.tick_history.append(tick_dict)
+
+    def _sync_subscriptions(self):
+        """
+        按当前 universe、常驻合约与持仓合约调整向行情前置的订阅，只订阅新增的合约、退订不再需要的合约。
+        未登录时只记录订阅集合，登录成功后由 on_login 统一订阅。
+        """
+        with self._subscribe_lock:
+            target = set()
+            for order_book_id in self.subscribed | self._always_subscribe | self._position_ids:
+                info = symbol_registry.get(order_book_id)
+                if info is None:
+                    self.on_debug('找不到 {} 对应的 CTP 合约代码，无法订阅其行情'.format(order_book_id))
+                else:
+                    target.add(info.instrument_id)
+            to_subscribe = target - self._md_subscribed
+            to_unsubscribe = self._md_subscribed - target
+            self._md_subscribed = target
+            for md_api in self._md_apis:
+                if md_api.logged_in:
+                    md_api.subscribe(sorted(to_subscribe))
+                    md_api.unsubscribe(sorted(to_unsubscribe))
+
+    def on_login(self, md_api):
+        """
+        行情前置登录成功，包括断线重连后的重新登录。CTP 不会保留之前的订阅，需全部重新订阅。
+        若此前所有前置都已断开，则记录一次行情中断。
+        """
+        with self._subscribe_lock:
+            instrument_ids = sorted(self._md_subscribed)
+            md_api.subscribe(instrument_ids)
+            down_since, self._down_since = self._down_since, None
+            if down_since is None:
+                return
+            started, start_time = down_since
+            gap = {
+                'address': md_api.address,
+                'start': start_time,
+                'duration': monotonic() - started,
+                # 重连后各合约第一笔行情的本笔成交量，即断线期间错过的成交量
+                'missed_volume': {},
+            }
+            self.gaps.append(gap)
+            for instrument_id in instrument_ids:
+                order_book_id = symbol_registry.lookup(instrument_id).order_book_id
+                if order_book_id is not None:
+                    self._gap_pending[order_book_id] = gap
+            if self._gap_events is not None:
+                self._gap_events.append(gap)
+        self.on_log('行情前置 {} 重连成功，行情中断 {:.1f} 秒，已重新订阅 {} 个合约。'.format(
+            md_api.address, gap['duration'], len(instrument_ids)))
+
+    def on_login_failed(self, md_api):
+        # 断线重连后 CTP 只会自动重新连接，登录失败后需要自行重试
+        if md_api.connected:
+            timer = Timer(self._retry_interval, md_api.login)
+            timer.setDaemon(True)
+            timer.start()
+
+    def on_disconnected(self, md_api, reason):
+        self.on_log('行情前置 {} 断开（原因 {:#x}），将自动重连。'.format(md_api.address, reason))
+        with self._subscribe_lock:
+            self.disconnects += 1
+            if self._down_since is None and not any(api.logged_in for api in self._md_apis):
+                self._down_since = (monotonic(), datetime.now())
+
+    def pop_gap_events(self):
+        """
+        取出尚未作为 CTP_EVENT.MD_RECONNECTED 事件发出的行情中断记录，未开启 event.reconnect_event 时总是为空。
+        """
+        events = []
+        while self._gap_events:
+            events.append(self._gap_events.popleft())
+        return events
+
+    @property
+    def reconnect_stats(self):
+        gaps = list(self.gaps)
+        return {
+            'disconnects': self.disconnects,
+            'gaps': gaps,
+            'total_gap_seconds': sum(gap['duration'] for gap in gaps),
+        }
 
     def on_universe_changed(self, event):
-        self.subscribed = event.universe
+        subscribed = set(event.universe)
+        infos = [symbol_registry.get(order_book_id) for order_book_id in subscribed]
+        with self._wanted_lock:
+            self.subscribed = subscribed
+            self.wanted_ids = frozenset(info.instrument_id for info in infos if info is not None)
+        self._sync_subscriptions()
+
+    def on_positions_changed(self, event):
+        """
+        持仓合约即使不在 universe 中也需要行情来计算市值。每次成交后按当前仍有持仓的合约重新计算，
+        开仓的合约补充订阅，全部平仓的合约若不在 universe 与常驻合约中则退订。
+        """
+        portfolio = self._env.portfolio
+        if portfolio is None:
+            return
+        position_ids = frozenset(
+            order_book_id for order_book_id, position in portfolio.positions.items()
+            if position.buy_quantity or position.sell_quantity
+        )
+        if position_ids != self._position_ids:
+            self._position_ids = position_ids
+            self._sync_subscriptions()
 
     @staticmethod
     def on_debug(debug):
@@ -90,3 +417,44 @@ class MdGateway(object):
     @staticmethod
     def on_err(error, func_name):
         system_log.error('CTP 错误，错误代码：%s，错误信息：%s' % (str(error.ErrorID), error.ErrorMsg.decode('GBK')))
+
+
+class ReplayMdGateway(MdGateway):
+    """
+    从行情日志回放 tick 的行情网关，不连接 CTP。回放的 tick 与实盘一样经过 TickDict 和 on_tick 进入队列。
+
+    speed 为回放倍速，按日志中记录的本地接收时间间隔控制节奏；为 0 时不做等待，尽快回放。
+    """
+    def __init__(self, env, path, speed=1, **kwargs):
+        super(ReplayMdGateway, self).__init__(env, **kwargs)
+        self._path = path
+        self._speed = speed
+        self.finished = False
+
+    def connect(self, *args, **kwargs):
+        self._env.event_bus.add_listener(EVENT.POST_UNIVERSE_CHANGED, self.on_universe_changed)
+
+    def start(self):
+        replay_thread = Thread(target=self._replay)
+        replay_thread.setDaemon(True)
+        replay_thread.start()
+
+    def _replay(self):
+        start_time = start_recv_time = None
+        for recv_time, data in read_ticks(self._path):
+            if self._speed > 0:
+                if start_time is None:
+                    start_time, start_recv_time = monotonic(), recv_time
+                delay = start_time + (recv_time - start_recv_time) / self._speed - monotonic()
+                if delay > 0:
+                    sleep(delay)
+            if not self.accept(data):
+                continue
+            tick_dict = self.tick_class(data)
+            if tick_dict.is_valid:
+                self.on_tick(tick_dict)
+        self.on_log('行情日志回放完成。')
+        self.finished = True
+
+    def exit(self):
+        self._close_writers()
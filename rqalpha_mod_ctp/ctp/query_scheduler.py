@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+from itertools import count
+from threading import Thread, Condition
+
+from rqalpha.utils.logger import system_log
+
+from ..utils import monotonic
+
+
+# ReqQry* 的返回值：-2 未处理请求超过许可数，-3 每秒发送请求数超过许可数
+FLOW_CONTROL_ERRORS = (-2, -3)
+
+# 数值越小越先发出
+QUERY_PRIORITY_ACCOUNT = 0
+QUERY_PRIORITY_POSITION = 0
+QUERY_PRIORITY_ORDER = 1
+QUERY_PRIORITY_INSTRUMENT = 1
+QUERY_PRIORITY_DEPTH_MARKET_DATA = 2
+QUERY_PRIORITY_COMMISSION = 3
+
+
+class TokenBucket(object):
+    """
+    每秒补充 rate 个令牌，最多积攒 capacity 个，每发出一个查询消耗一个令牌。
+    """
+    def __init__(self, rate, capacity):
+        self._rate = float(rate)
+        self._capacity = float(max(capacity, 1))
+        self._tokens = self._capacity
+        self._last = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def wait_time(self):
+        """
+        距离下一个令牌可用还需等待的秒数。
+        """
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def consume(self):
+        self._tokens -= 1
+
+    def drain(self):
+        # 被柜台流控后清空令牌，下一次至少等待一个完整的补充周期
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+
+
+class QueryScheduler(object):
+    """
+    CtpTdApi 的查询调度器。所有 ReqQry* 请求先进入按 (优先级, 提交顺序) 排序的队列，
+    由后台线程按令牌桶的速率逐个发出，不会触发 CTP 的查询流控。
+
+    同一 key 的查询在完成或被取消之前只会排队、发送一次，重复提交会得到同一个 QueryFuture。
+    发出时返回 -2/-3 的查询按原来的顺序放回队列，并清空令牌桶；返回其他非零值的查询以该返回值作为 future 的 error 结束，
+    发送时抛出异常的查询以该异常作为 error 结束。
+    """
+    def __init__(self, dispatch, rate=1, burst=1):
+        self._dispatch = dispatch
+        self._bucket = TokenBucket(rate, burst)
+        self._heap = []
+        self._seq = count()
+        # key -> [future, 在队列中时为其提交序号，已发出时为 None]
+        self._pending = {}
+        self._cond = Condition()
+        self._thread = Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def submit(self, key, priority, send, future):
+        """
+        提交一个查询。send(req_id) 发出请求并返回 ReqQry* 的返回值；已有相同 key 的查询未完成时返回已有的 future。
+        """
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending[0]
+            seq = next(self._seq)
+            self._pending[key] = [future, seq]
+            heapq.heappush(self._heap, (priority, seq, key, send))
+            self._cond.notify()
+        return future
+
+    def done(self, key, future):
+        """
+        查询完成或被取消，此后相同 key 的查询会重新发出。
+        """
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] is future:
+                del self._pending[key]
+
+    def _is_queued(self, item):
+        pending = self._pending.get(item[2])
+        return pending is not None and pending[1] == item[1]
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap and not self._is_queued(self._heap[0]):
+                    # 已取消的查询
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._bucket.wait_time()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                self._bucket.consume()
+                item = heapq.heappop(self._heap)
+                pending = self._pending[item[2]]
+                pending[1] = None
+                return item, pending[0]
+
+    def _run(self):
+        while True:
+            item, future = self._next()
+            priority, seq, key, send = item
+            try:
+                ret = self._dispatch(send, future)
+            except Exception as e:
+                system_log.error('发送查询 {} 失败：{}', key, e)
+                self.done(key, future)
+                future.set_error(e)
+                continue
+            if ret in FLOW_CONTROL_ERRORS:
+                system_log.debug('查询 {} 被流控（{}），稍后重新发送', key, ret)
+                with self._cond:
+                    pending = self._pending.get(key)
+                    if pending is not None and pending[0] is future:
+                        pending[1] = seq
+                        heapq.heappush(self._heap, item)
+                    self._bucket.drain()
+            elif ret:
+                system_log.warning('发送查询 {} 失败，返回值 {}', key, ret)
+                self.done(key, future)
+                future.set_error(ret)
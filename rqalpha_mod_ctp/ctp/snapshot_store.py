@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from ..utils import bytes2str
+
+
+# 快照字段与 TickDict 同名，后一列为未订阅合约直接从 DepthMarketData 写入时对应的字段
+SNAPSHOT_FIELDS = (
+    ('date', '<i8', 'TradingDay'),
+    ('time', '<i8', 'UpdateTime'),
+    ('open', '<f8', 'OpenPrice'),
+    ('last', '<f8', 'LastPrice'),
+    ('low', '<f8', 'LowestPrice'),
+    ('high', '<f8', 'HighestPrice'),
+    ('prev_close', '<f8', 'PreClosePrice'),
+    ('volume', '<i8', 'Volume'),
+    ('total_turnover', '<f8', 'Turnover'),
+    ('open_interest', '<f8', 'OpenInterest'),
+    ('prev_settlement', '<f8', 'SettlementPrice'),
+    ('b1', '<f8', 'BidPrice1'),
+    ('b2', '<f8', 'BidPrice2'),
+    ('b3', '<f8', 'BidPrice3'),
+    ('b4', '<f8', 'BidPrice4'),
+    ('b5', '<f8', 'BidPrice5'),
+    ('b1_v', '<i8', 'BidVolume1'),
+    ('b2_v', '<i8', 'BidVolume2'),
+    ('b3_v', '<i8', 'BidVolume3'),
+    ('b4_v', '<i8', 'BidVolume4'),
+    ('b5_v', '<i8', 'BidVolume5'),
+    ('a1', '<f8', 'AskPrice1'),
+    ('a2', '<f8', 'AskPrice2'),
+    ('a3', '<f8', 'AskPrice3'),
+    ('a4', '<f8', 'AskPrice4'),
+    ('a5', '<f8', 'AskPrice5'),
+    ('a1_v', '<i8', 'AskVolume1'),
+    ('a2_v', '<i8', 'AskVolume2'),
+    ('a3_v', '<i8', 'AskVolume3'),
+    ('a4_v', '<i8', 'AskVolume4'),
+    ('a5_v', '<i8', 'AskVolume5'),
+    ('limit_up', '<f8', 'UpperLimitPrice'),
+    ('limit_down', '<f8', 'LowerLimitPrice'),
+)
+
+# 由相邻两笔行情推算的字段：本笔成交量、本笔成交额、当日均价、中间价、买卖价差
+DERIVED_FIELDS = (
+    ('last_volume', '<i8'),
+    ('last_turnover', '<f8'),
+    ('vwap', '<f8'),
+    ('mid', '<f8'),
+    ('spread', '<f8'),
+)
+DERIVED_FIELD_NAMES = tuple(name for name, _ in DERIVED_FIELDS)
+
+SNAPSHOT_DTYPE = np.dtype([(name, fmt) for name, fmt, _ in SNAPSHOT_FIELDS] + list(DERIVED_FIELDS))
+SNAPSHOT_FIELD_NAMES = SNAPSHOT_DTYPE.names
+
+_BASE_FIELD_NAMES = tuple(name for name, _, _ in SNAPSHOT_FIELDS)
+# date 与 time 需要解析，其余字段原样取出
+_RAW_VALUE_FIELDS = tuple(raw_name for _, _, raw_name in SNAPSHOT_FIELDS[2:])
+_DATE, _TIME, _VOLUME, _TURNOVER, _B1, _A1 = (_BASE_FIELD_NAMES.index(name) for name in (
+    'date', 'time', 'volume', 'total_turnover', 'b1', 'a1'))
+
+# CTP 以 DBL_MAX 表示无效价格
+INVALID_PRICE = 1e300
+NAN = float('nan')
+
+# 不早于该时刻（HHMMSSmmm）的行情属于夜盘
+NIGHT_SESSION_TIME = 180000000
+
+
+def is_new_trading_day(prev_date, prev_time, prev_volume, date, volume):
+    """
+    判断一笔行情是否开始了新的交易日，即累计成交量、成交额从零重新计算。
+
+    累计成交量变小时必然是新的交易日。TradingDay 变化而上一笔是夜盘行情时则不是：郑商所夜盘的 TradingDay 为自然日，
+    次日日盘开盘时 TradingDay 改变，累计成交量却延续夜盘。
+    """
+    return volume < prev_volume or (date != prev_date and prev_time < NIGHT_SESSION_TIME)
+
+
+def tick_record(tick_dict):
+    """
+    将 TickDict 转换为一条不含推算字段的快照记录（tuple），由 SnapshotStore.update 补全。
+    """
+    return tuple(tick_dict[name] for name in _BASE_FIELD_NAMES)
+
+
+def raw_record(data):
+    """
+    不经过 TickDict，直接将 DepthMarketData 转换为一条不含推算字段的快照记录，无法解析时返回 None。
+    """
+    try:
+        date = int(data.TradingDay)
+        time = int(bytes2str(data.UpdateTime).replace(':', '')) * 1000 + int(data.UpdateMillisec)
+    except ValueError:
+        return None
+    return (date, time) + tuple(getattr(data, name) for name in _RAW_VALUE_FIELDS)
+
+
+class SnapshotStore(object):
+    """
+    按列存储的最新行情快照。
+
+    每个合约占用结构化数组中的一行，行情回调原地覆盖该行，槽位不够时成倍扩容。
+    除按合约读取整行外，还提供 last_prices 等按一组合约批量取值的接口，返回 numpy 数组，缺失的合约为 nan。
+    """
+    def __init__(self, capacity=1024):
+        self._data = np.zeros(capacity, dtype=SNAPSHOT_DTYPE)
+        self._index = {}
+
+    def _row_of(self, order_book_id):
+        try:
+            return self._index[order_book_id]
+        except KeyError:
+            row = len(self._index)
+            if row >= len(self._data):
+                data = np.zeros(len(self._data) * 2, dtype=SNAPSHOT_DTYPE)
+                data[:row] = self._data[:row]
+                self._data = data
+            self._index[order_book_id] = row
+            return row
+
+    def update(self, order_book_id, record, turnover_unit=NAN):
+        """
+        用一条由 tick_record 或 raw_record 得到的记录覆盖合约的快照，并与上一笔快照比较补全推算字段，返回完整的记录。
+
+        进入新的交易日（见 is_new_trading_day）时，本笔成交量即为累计成交量；此前没有快照时记为 0。
+        turnover_unit 为成交额与 成交量 * 价格 之比，郑商所为 1，其他交易所为合约乘数，未知时均价为 nan。
+        """
+        row = self._row_of(order_book_id)
+        data = self._data
+        previous = data[row]
+        prev_date, prev_volume, prev_turnover = previous['date'], previous['volume'], previous['total_turnover']
+
+        volume, turnover = record[_VOLUME], record[_TURNOVER]
+        if prev_date == 0:
+            last_volume, last_turnover = 0, 0.
+        elif is_new_trading_day(prev_date, previous['time'], prev_volume, record[_DATE], volume):
+            last_volume, last_turnover = volume, turnover
+        else:
+            last_volume, last_turnover = volume - prev_volume, turnover - prev_turnover
+        vwap = turnover / (volume * turnover_unit) if volume > 0 else NAN
+
+        b1, a1 = record[_B1], record[_A1]
+        if 0 < b1 < INVALID_PRICE and 0 < a1 < INVALID_PRICE:
+            mid, spread = (a1 + b1) / 2, a1 - b1
+        else:
+            mid = spread = NAN
+
+        record = record + (last_volume, last_turnover, vwap, mid, spread)
+        data[row] = record
+        return record
+
+    def __contains__(self, order_book_id):
+        return order_book_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, order_book_id, default=None):
+        """
+        返回合约快照的一份拷贝（SNAPSHOT_DTYPE 的一行），可按字段名取值，也可直接用于构造 SnapshotObject。
+        """
+        row = self._index.get(order_book_id)
+        if row is None:
+            return default
+        return self._data[row].copy()
+
+    def get_value(self, order_book_id, field):
+        row = self._index.get(order_book_id)
+        if row is None:
+            return None
+        return self._data[field][row]
+
+    def column(self, field, order_book_ids):
+        index, data = self._index, self._data
+        rows = np.array([index.get(order_book_id, -1) for order_book_id in order_book_ids], dtype=np.int64)
+        values = data[field][rows].astype(np.float64)
+        values[rows < 0] = np.nan
+        return values
+
+    def last_prices(self, order_book_ids):
+        return self.column('last', order_book_ids)
+
+    def limit_up(self, order_book_ids):
+        return self.column('limit_up', order_book_ids)
+
+    def limit_down(self, order_book_ids):
+        return self.column('limit_down', order_book_ids)
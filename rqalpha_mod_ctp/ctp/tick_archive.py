@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from collections import defaultdict
+from threading import Thread
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+import numpy as np
+
+from rqalpha.utils.logger import system_log
+
+from .snapshot_store import SNAPSHOT_DTYPE
+
+
+# 写线程每批最多处理的 tick 数量
+ARCHIVE_BATCH_SIZE = 4096
+
+
+def archive_file(root, trading_day, order_book_id):
+    return os.path.join(root, str(trading_day), '{}.bin'.format(order_book_id))
+
+
+class TickArchiveWriter(object):
+    """
+    将 tick 按交易日、合约追加写入 root/<交易日>/<order_book_id>.bin。
+
+    每条记录为一行 SNAPSHOT_DTYPE，定长、无文件头，可直接用 read_archive 以 np.memmap 方式读取。
+    写入由后台线程完成：行情回调只把记录放入队列，写线程每次取出一批，按合约合并为一次 write。
+    """
+    def __init__(self, root):
+        self.root = root
+        self._queue = Queue()
+        # (交易日, order_book_id) -> 文件，以及已收到的最新交易日
+        self._files = {}
+        self._trading_day = None
+        self._thread = Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def write(self, order_book_id, record):
+        self._queue.put((order_book_id, record))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _file_of(self, trading_day, order_book_id):
+        try:
+            return self._files[(trading_day, order_book_id)]
+        except KeyError:
+            pass
+        if self._trading_day is None or trading_day > self._trading_day:
+            # 夜盘开始前后各合约切换交易日的时刻不一致，同一批中可能混有前后两个交易日的 tick，
+            # 因此只关闭比上一交易日更早的文件；迟到的旧交易日 tick 会重新以追加方式打开文件
+            for key in [key for key in self._files if self._trading_day is None or key[0] < self._trading_day]:
+                self._files.pop(key).close()
+            self._trading_day = trading_day
+        directory = os.path.join(self.root, str(trading_day))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        f = self._files[(trading_day, order_book_id)] = open(archive_file(self.root, trading_day, order_book_id), 'ab')
+        return f
+
+    def _write_batch(self, batch):
+        grouped = defaultdict(list)
+        for order_book_id, record in batch:
+            grouped[(record[0], order_book_id)].append(record)
+        for (trading_day, order_book_id), records in sorted(grouped.items()):
+            f = self._file_of(trading_day, order_book_id)
+            f.write(np.array(records, dtype=SNAPSHOT_DTYPE).tobytes())
+            f.flush()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            while len(batch) < ARCHIVE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            if None in batch:
+                batch = [item for item in batch if item is not None]
+                closing = True
+            try:
+                self._write_batch(batch)
+            except (IOError, OSError) as e:
+                system_log.error('tick 归档写入失败：{}', e)
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+def read_archive(root, trading_day, order_book_id):
+    """
+    以只读 np.memmap 的方式打开某交易日某合约的 tick 归档，可按字段名取出各列，不会把整个文件读入内存。
+    文件不存在时返回空数组；正在写入的文件末尾不完整的记录会被忽略。
+    """
+    path = archive_file(root, trading_day, order_book_id)
+    count = os.path.getsize(path) // SNAPSHOT_DTYPE.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return np.empty(0, dtype=SNAPSHOT_DTYPE)
+    return np.memmap(path, dtype=SNAPSHOT_DTYPE, mode='r', shape=(count, ))
+
+
+def archived_instruments(root, trading_day):
+    directory = os.path.join(root, str(trading_day))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.bin'))
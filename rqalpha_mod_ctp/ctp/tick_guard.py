@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+
+
+# 早于该小时的 UpdateTime 属于夜盘跨过零点之后或日盘，排在当天夜盘之后
+NIGHT_SESSION_HOUR = 18
+
+
+class TickSequenceGuard(object):
+    """
+    按合约检查原始行情的 (TradingDay, UpdateTime, UpdateMillisec, Volume) 是否严格递增。
+
+    前置重新登录后会重发最新的一笔行情，连接多个前置时同一笔行情也会重复到达，这些行情与已收到的行情键值相同，
+    记为重复；键值更小的记为乱序。两者都应在构建 TickDict 之前丢弃。
+
+    连接多个前置时，source 为行情来自的前置序号，now 为收到行情的时刻。每笔行情只有最先到达的一份会通过，
+    其他前置随后送达同一笔行情时，记录最先到达的前置领先的次数与累计领先时间。
+
+    郑商所夜盘的 TradingDay 为自然日，与当天日盘相同，因此同一 TradingDay 的日盘之后到达的夜盘行情视为新的交易时段，
+    不与日盘比较。
+    """
+    def __init__(self):
+        self._last_keys = {}
+        self._first_arrivals = {}
+        self.duplicates = defaultdict(int)
+        self.regressions = defaultdict(int)
+        self.lead_count = defaultdict(int)
+        self.lead_time = defaultdict(float)
+
+    def check(self, data, source=0, now=None):
+        """
+        返回该行情是否比同一合约已收到的行情更新。无法解析时间的行情交给 TickDict 处理。
+        """
+        update_time = data.UpdateTime
+        try:
+            hour = int(update_time[:2])
+        except ValueError:
+            return True
+        if hour < NIGHT_SESSION_HOUR:
+            hour += 24
+        key = (data.TradingDay, hour, update_time[2:], data.UpdateMillisec, data.Volume)
+
+        instrument_id = data.InstrumentID
+        last_key = self._last_keys.get(instrument_id)
+        if last_key is not None and key <= last_key and not (
+            hour < 24 and last_key[1] >= 24 and last_key[0] == key[0]
+        ):
+            if key == last_key:
+                self.duplicates[instrument_id] += 1
+                if now is not None:
+                    first_source, first_time = self._first_arrivals[instrument_id]
+                    if first_source != source:
+                        self.lead_count[first_source] += 1
+                        self.lead_time[first_source] += now - first_time
+            else:
+                self.regressions[instrument_id] += 1
+            return False
+        self._last_keys[instrument_id] = key
+        if now is not None:
+            self._first_arrivals[instrument_id] = (source, now)
+        return True
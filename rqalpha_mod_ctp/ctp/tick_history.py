@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from .snapshot_store import is_new_trading_day
+
+
+TICK_HISTORY_DTYPE = np.dtype([
+    ('date', '<i8'),
+    ('time', '<i8'),
+    ('last', '<f8'),
+    ('volume', '<i8'),
+    ('open_interest', '<f8'),
+    ('b1', '<f8'),
+    ('b2', '<f8'),
+    ('b3', '<f8'),
+    ('b4', '<f8'),
+    ('b5', '<f8'),
+    ('b1_v', '<i8'),
+    ('b2_v', '<i8'),
+    ('b3_v', '<i8'),
+    ('b4_v', '<i8'),
+    ('b5_v', '<i8'),
+    ('a1', '<f8'),
+    ('a2', '<f8'),
+    ('a3', '<f8'),
+    ('a4', '<f8'),
+    ('a5', '<f8'),
+    ('a1_v', '<i8'),
+    ('a2_v', '<i8'),
+    ('a3_v', '<i8'),
+    ('a4_v', '<i8'),
+    ('a5_v', '<i8'),
+])
+
+_BOOK_FIELDS = TICK_HISTORY_DTYPE.names[5:]
+
+
+class TickRing(object):
+    """
+    单个合约最近 capacity 个 tick 的环形缓冲区，volume 为相邻两个 tick 之间的成交量增量。
+
+    缓冲区长度为 2 * capacity，每个 tick 同时写入 i 和 i + capacity 两个位置，
+    因此任意最近 n 个 tick 在数组中总是连续的，可以直接返回视图而无需拷贝。
+    """
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._buffer = np.zeros(capacity * 2, dtype=TICK_HISTORY_DTYPE)
+        self._count = 0
+        self._trading_day = None
+        self._last_time = 0
+        self._cum_volume = 0
+
+    def append(self, tick):
+        volume = tick.volume
+        if self._trading_day is None:
+            # 第一个 tick 的累计成交量包含启动之前的成交，只作为起点
+            self._cum_volume = volume
+        elif is_new_trading_day(self._trading_day, self._last_time, self._cum_volume, tick.date, volume):
+            self._cum_volume = 0
+        self._trading_day = tick.date
+        self._last_time = tick.time
+        record = (tick.date, tick.time, tick.last, volume - self._cum_volume, tick.open_interest) + \
+            tuple(tick[name] for name in _BOOK_FIELDS)
+        self._cum_volume = volume
+
+        i = self._count % self._capacity
+        self._buffer[i] = record
+        self._buffer[i + self._capacity] = record
+        self._count += 1
+
+    def last(self, n):
+        """
+        按时间先后返回最近 n 个 tick（不足 n 个时返回全部）的只读视图。
+        视图在此后的 capacity - n 个 tick 内保持不变，需要长期持有时应自行拷贝。
+        """
+        count = self._count
+        n = min(n, count, self._capacity)
+        end = (count - 1) % self._capacity + self._capacity + 1
+        view = self._buffer[end - n:end]
+        view.flags.writeable = False
+        return view
+
+
+class TickHistory(object):
+    """
+    为每个收到行情的合约维护一个 TickRing。
+    """
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._rings = {}
+
+    def append(self, tick):
+        try:
+            ring = self._rings[tick.order_book_id]
+        except KeyError:
+            ring = self._rings[tick.order_book_id] = TickRing(self._capacity)
+        ring.append(tick)
+
+    def last(self, order_book_id, n):
+        ring = self._rings.get(order_book_id)
+        if ring is None:
+            return np.empty(0, dtype=TICK_HISTORY_DTYPE)
+        return ring.last(n)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict, defaultdict
+from threading import Condition, Lock
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from ..utils import monotonic
+
+
+class ConflatingTickQueue(object):
+    """
+    按 order_book_id 合并的 tick 队列，接口与 Queue 的 put/get/get_nowait/qsize 一致。
+
+    每个合约只保留最新的一个待处理 tick，合约按其最早一次未处理更新的到达顺序出队，
+    因此队列长度不超过订阅的合约数，策略处理不过来时总是拿到最新行情。被覆盖的 tick 按合约计数。
+    """
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._not_empty = Condition(Lock())
+        self.dropped = defaultdict(int)
+
+    def put(self, tick_dict):
+        order_book_id = tick_dict.order_book_id
+        with self._not_empty:
+            if order_book_id in self._pending:
+                self.dropped[order_book_id] += 1
+            self._pending[order_book_id] = tick_dict
+            self._not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if not block:
+                if not self._pending:
+                    raise Empty
+            elif timeout is None:
+                while not self._pending:
+                    self._not_empty.wait()
+            else:
+                deadline = monotonic() + timeout
+                while not self._pending:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    self._not_empty.wait(remaining)
+            return self._pending.popitem(last=False)[1]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return len(self._pending)
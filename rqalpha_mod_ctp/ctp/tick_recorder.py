@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import time
+from collections import namedtuple
+from threading import Lock
+
+from ..utils import str2bytes
+
+
+# DepthMarketData 的全部字段及其二进制格式，顺序与 ApiStruct.DepthMarketData 一致
+DEPTH_MARKET_DATA_FIELDS = (
+    ('TradingDay', '9s'),
+    ('InstrumentID', '31s'),
+    ('ExchangeID', '9s'),
+    ('ExchangeInstID', '31s'),
+    ('LastPrice', 'd'),
+    ('PreSettlementPrice', 'd'),
+    ('PreClosePrice', 'd'),
+    ('PreOpenInterest', 'd'),
+    ('OpenPrice', 'd'),
+    ('HighestPrice', 'd'),
+    ('LowestPrice', 'd'),
+    ('Volume', 'i'),
+    ('Turnover', 'd'),
+    ('OpenInterest', 'd'),
+    ('ClosePrice', 'd'),
+    ('SettlementPrice', 'd'),
+    ('UpperLimitPrice', 'd'),
+    ('LowerLimitPrice', 'd'),
+    ('PreDelta', 'd'),
+    ('CurrDelta', 'd'),
+    ('UpdateTime', '9s'),
+    ('UpdateMillisec', 'i'),
+    ('BidPrice1', 'd'),
+    ('BidVolume1', 'i'),
+    ('AskPrice1', 'd'),
+    ('AskVolume1', 'i'),
+    ('BidPrice2', 'd'),
+    ('BidVolume2', 'i'),
+    ('AskPrice2', 'd'),
+    ('AskVolume2', 'i'),
+    ('BidPrice3', 'd'),
+    ('BidVolume3', 'i'),
+    ('AskPrice3', 'd'),
+    ('AskVolume3', 'i'),
+    ('BidPrice4', 'd'),
+    ('BidVolume4', 'i'),
+    ('AskPrice4', 'd'),
+    ('AskVolume4', 'i'),
+    ('BidPrice5', 'd'),
+    ('BidVolume5', 'i'),
+    ('AskPrice5', 'd'),
+    ('AskVolume5', 'i'),
+    ('AveragePrice', 'd'),
+    ('ActionDay', '9s'),
+)
+
+FIELD_NAMES = tuple(name for name, _ in DEPTH_MARKET_DATA_FIELDS)
+STRING_FIELDS = frozenset(name for name, fmt in DEPTH_MARKET_DATA_FIELDS if fmt.endswith('s'))
+
+# 每条记录为本地接收时间（time.time()）加上 DepthMarketData 的全部字段，小端、无对齐
+RECORD = struct.Struct('<d' + ''.join(fmt for _, fmt in DEPTH_MARKET_DATA_FIELDS))
+
+# 回放时代替 ApiStruct.DepthMarketData，TickDict 只按属性名读取字段
+DepthMarketData = namedtuple('DepthMarketData', FIELD_NAMES)
+
+
+class TickRecorder(object):
+    """
+    将收到的原始行情逐条写入定长二进制日志，供 ReplayEventSource 回放。
+    """
+    def __init__(self, path, buffer_size=1 << 20):
+        self._file = open(path, 'ab', buffer_size)
+        self._lock = Lock()
+
+    def write(self, data, recv_time=None):
+        values = [time.time() if recv_time is None else recv_time]
+        for name in FIELD_NAMES:
+            value = getattr(data, name)
+            values.append(str2bytes(value) if name in STRING_FIELDS else value)
+        record = RECORD.pack(*values)
+        with self._lock:
+            self._file.write(record)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_ticks(path, chunk_records=4096):
+    """
+    逐条读取行情日志，产出 (本地接收时间, DepthMarketData)。
+    """
+    size = RECORD.size
+    string_indexes = [i for i, name in enumerate(FIELD_NAMES) if name in STRING_FIELDS]
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(size * chunk_records)
+            if not chunk:
+                break
+            for offset in range(0, len(chunk) - size + 1, size):
+                values = list(RECORD.unpack_from(chunk, offset))
+                recv_time = values.pop(0)
+                for i in string_indexes:
+                    values[i] = values[i].rstrip(b'\x00')
+                yield recv_time, DepthMarketData(*values)
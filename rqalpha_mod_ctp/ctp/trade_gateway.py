@@ -30,19 +30,27 @@ from rqalpha.model.base_position import Positions
 
 from .api import CtpTdApi
 from .data_dict import FakeTickDict
-from ..utils import cal_commission, margin_of
+from ..trading_session import SessionTable
+from ..utils import cal_commission, margin_of, symbol_registry
+
+
+# 全市场行情查询分成数千条回报返回，单独给一个较长的超时时间（秒）
+DEPTH_MARKET_DATA_TIMEOUT = 30
+# 查询在调度队列中等待发出的最长时间（秒）
+QUERY_SEND_TIMEOUT = 60
 
 
 class TradeGateway(object):
-    def __init__(self, env, retry_times=5, retry_interval=1):
+    def __init__(self, env, retry_times=5, retry_interval=1, query_rate=1, query_burst=1):
         self._env = env
 
         self._retry_times = retry_times
         self._retry_interval = retry_interval
+        self._query_rate = query_rate
+        self._query_burst = query_burst
 
         self._cache = DataCache()
 
-        self._query_returns = {}
         self._data_update_date = date.min
 
         self.td_api = None
@@ -51,7 +59,8 @@ class TradeGateway(object):
 
     def connect(self, user_id, password, broker_id, td_address):
 
-        self.td_api = CtpTdApi(self, user_id, password, broker_id, td_address)
+        self.td_api = CtpTdApi(self, user_id, password, broker_id, td_address, query_rate=self._query_rate,
+                               query_burst=self._query_burst)
         for i in range(self._retry_times):
             self.td_api.connect()
             sleep(self._retry_interval * (i+1))
@@ -69,7 +78,10 @@ class TradeGateway(object):
             self._qry_position()
             self._qry_order()
             self._data_update_date = date.today()
-            self._qry_commission()
+            # 费率查询先全部排队，优先级更高的行情快照查询会插到它们前面发出
+            commission_futures = self._qry_commission()
+            self._qry_depth_market_data()
+            self._wait_commission(commission_futures)
 
         sleep(5)
         self.on_log('数据同步完成。')
@@ -107,9 +119,6 @@ class TradeGateway(object):
     def exit(self):
         self.td_api.close()
 
-    def on_query(self, api_name, n, result):
-        self._query_returns[n] = result
-
     def on_order(self, order_dict):
         if not order_dict.is_valid:
             return
@@ -173,73 +182,118 @@ class TradeGateway(object):
             order.fill(trade)
             self._env.event_bus.publish_event(RqEvent(EVENT.TRADE, account=account, trade=trade))
 
-    def _qry_instrument(self):
+    def _query(self, qry, *args):
+        """
+        发送查询并等待最后一条回报，等待时间随重试次数递增；发送失败时稍后重新查询。返回查询结果，全部超时或失败时返回 None。
+        查询由 CtpTdApi 按流控速率排队发出，超时从查询实际发出时开始计算，排队超过 QUERY_SEND_TIMEOUT 时放弃。
+        已发出的查询不会被取消重发，而是继续等待同一个查询的回报，直至重试次数用完。
+        """
+        future = None
         for i in range(self._retry_times):
-            req_id = self.td_api.qryInstrument()
-            sleep(self._retry_interval * (i+1))
-            if req_id in self._query_returns:
-                ins_cache = self._query_returns[req_id].copy()
-                del self._query_returns[req_id]
-                self.on_debug('%d 条合约数据返回。' % len(ins_cache))
-                self._cache.cache_ins(ins_cache)
-                break
-        else:
+            if future is None:
+                future = qry(*args)
+                if future is None:
+                    return None
+                if not future.wait_sent(QUERY_SEND_TIMEOUT):
+                    self.on_log('查询 {} 排队超时'.format(future.key))
+                    break
+            if future.wait(self._retry_interval * (i + 1)):
+                if future.error is None:
+                    return future.result
+                future = None
+                sleep(self._retry_interval)
+        if future is not None:
+            self.td_api.cancel_query(future)
+        return None
+
+    def _qry_instrument(self):
+        ins_cache = self._query(self.td_api.qryInstrument)
+        if ins_cache is None:
             raise RuntimeError('请求合约数据超时')
+        ins_cache = ins_cache.copy()
+        self.on_debug('%d 条合约数据返回。' % len(ins_cache))
+        for ins_dict in itervalues(ins_cache):
+            symbol_registry.register(ins_dict.instrument_id, ins_dict.order_book_id, ins_dict.underlying_symbol,
+                                     ins_dict.exchange_id, ins_dict.contract_multiplier)
+        self._cache.cache_ins(ins_cache)
 
     def _qry_account(self):
-        for i in range(self._retry_times):
-            req_id = self.td_api.qryAccount()
-            sleep(self._retry_interval * (i+1))
-            if req_id in self._query_returns:
-                account_dict = self._query_returns[req_id].copy()
-                del self._query_returns[req_id]
-                self.on_debug('账户数据返回: %s' % str(account_dict))
-                self._cache.cache_account(account_dict)
-                break
-        else:
+        account_dict = self._query(self.td_api.qryAccount)
+        if account_dict is None:
             raise RuntimeError('请求账户数据超时')
+        account_dict = account_dict.copy()
+        self.on_debug('账户数据返回: %s' % str(account_dict))
+        self._cache.cache_account(account_dict)
 
     def _qry_position(self):
-        for i in range(self._retry_times):
-            req_id = self.td_api.qryPosition()
-            sleep(self._retry_interval * (i+1))
-            if req_id in self._query_returns:
-                positions = self._query_returns[req_id].copy()
-                del self._query_returns[req_id]
-                self.on_debug('持仓数据返回: %s。' % str(positions.keys()))
-                self._cache.cache_position(positions)
-                break
+        positions = self._query(self.td_api.qryPosition)
+        if positions is not None:
+            positions = positions.copy()
+            self.on_debug('持仓数据返回: %s。' % str(positions.keys()))
+            self._cache.cache_position(positions)
 
     def _qry_order(self):
-        for i in range(self._retry_times):
-            req_id = self.td_api.qryOrder()
-            sleep(self._retry_interval * (i+1))
-            if req_id in self._query_returns:
-                order_cache = self._query_returns[req_id].copy()
-                del self._query_returns[req_id]
-                self.on_debug('订单数据返回')
-                for order_dict in order_cache.values():
-                    order = self._cache.get_cached_order(order_dict)
-                    if order_dict.status == ORDER_STATUS.ACTIVE:
-                        self._cache.cache_open_order(order)
-                self._cache.cache_qry_order(order_cache)
-
-                break
+        order_cache = self._query(self.td_api.qryOrder)
+        if order_cache is not None:
+            order_cache = order_cache.copy()
+            self.on_debug('订单数据返回')
+            for order_dict in order_cache.values():
+                order = self._cache.get_cached_order(order_dict)
+                if order_dict.status == ORDER_STATUS.ACTIVE:
+                    self._cache.cache_open_order(order)
+            self._cache.cache_qry_order(order_cache)
 
     def _qry_commission(self):
+        """
+        为尚无费率的每个品种提交一个费率查询，不等待回报，返回 {品种: (order_book_id, future)}，由 _wait_commission 等待。
+        """
+        futures = {}
         for order_book_id, ins_dict in iteritems(self._cache.ins):
-            if ins_dict.underlying_symbol in self._cache.future_info and 'commission_type' in self._cache.future_info[ins_dict.underlying_symbol]['speculation']:
+            underlying_symbol = ins_dict.underlying_symbol
+            if underlying_symbol in futures:
                 continue
-            for i in range(self._retry_times):
-                req_id = self.td_api.qryCommission(order_book_id)
-                sleep(self._retry_interval * (i + 1))
-                if req_id in self._query_returns:
-                    commission_dict = self._query_returns[req_id].copy()
-                    del self._query_returns[req_id]
-                    self._cache.cache_commission(ins_dict.underlying_symbol, commission_dict)
-                    break
+            if underlying_symbol in self._cache.future_info and \
+                    'commission_type' in self._cache.future_info[underlying_symbol]['speculation']:
+                continue
+            future = self.td_api.qryCommission(order_book_id)
+            if future is not None:
+                futures[underlying_symbol] = (order_book_id, future)
+        return futures
+
+    def _wait_commission(self, futures):
+        """
+        按提交顺序等待费率查询的回报；排队或等待回报超时、发送失败的查询改由 _query 重新查询。
+        """
+        for underlying_symbol, (order_book_id, future) in iteritems(futures):
+            if future.wait_sent(QUERY_SEND_TIMEOUT) and future.wait(self._retry_interval * self._retry_times) and \
+                    future.error is None:
+                commission_dict = future.result
+            else:
+                self.td_api.cancel_query(future)
+                commission_dict = self._query(self.td_api.qryCommission, order_book_id)
+            if commission_dict is not None:
+                self._cache.cache_commission(underlying_symbol, commission_dict.copy())
         self.on_debug('费率数据返回')
 
+    def _qry_depth_market_data(self):
+        # 不取消、不重发：重发会清空 depth_cache，而被放弃的查询仍在陆续返回回报
+        future = self.td_api.qryDepthMarketData()
+        if future is not None and not future.wait_sent(QUERY_SEND_TIMEOUT):
+            self.td_api.cancel_query(future)
+            future = None
+        if future is not None and future.wait(DEPTH_MARKET_DATA_TIMEOUT) and future.error is None:
+            self._cache.depth_market_data = list(future.result)
+            self.on_debug('%d 条行情快照返回。' % len(self._cache.depth_market_data))
+        else:
+            self.on_log('请求行情快照超时或失败，将等待行情推送。')
+
+    @property
+    def depth_market_data(self):
+        """
+        登录时通过交易接口查询到的全部合约的行情快照（原始 DepthMarketData），用于在收到第一笔行情推送前预填快照。
+        """
+        return self._cache.depth_market_data
+
     @property
     def open_orders(self):
         return self._cache.open_orders
@@ -248,6 +302,10 @@ class TradeGateway(object):
     def snapshot(self):
         return self._cache.snapshot
 
+    @property
+    def session_table(self):
+        return self._cache.session_table
+
     @staticmethod
     def on_debug(debug):
         system_log.debug(debug)
@@ -261,10 +319,20 @@ class TradeGateway(object):
         system_log.error('CTP 错误，错误代码：%s，错误信息：%s' % (str(error.ErrorID), error.ErrorMsg.decode('GBK')))
 
 
+def _trading_hours_of(order_book_id):
+    # 较新的 rqalpha 的 Instrument 才有 trading_hours
+    try:
+        instrument = Environment.get_instance().get_instrument(order_book_id)
+    except Exception:
+        return None
+    return getattr(instrument, 'trading_hours', None)
+
+
 class DataCache(object):
     def __init__(self):
         self.ins = {}
         self.future_info = {}
+        self.session_table = SessionTable()
 
         self.orders = {}
         self.open_orders = []
@@ -272,6 +340,7 @@ class DataCache(object):
 
         self.pos = {}
         self.snapshot = {}
+        self.depth_market_data = []
 
         self._account_dict = None
         self._qry_order_cache = {}
@@ -285,6 +354,7 @@ class DataCache(object):
                 'short_margin_ratio': ins_dict.short_margin_ratio,
                 'margin_type': ins_dict.margin_type,
             }} for ins_dict in self.ins.values()}
+        self.session_table = SessionTable(self.ins.values(), _trading_hours_of)
 
     def cache_commission(self, underlying_symbol, commission_dict):
         self.future_info[underlying_symbol]['speculation'].update({
@@ -20,16 +20,32 @@ from rqalpha.model.snapshot import SnapshotObject
 from rqalpha.utils.logger import system_log
 from datetime import date
 
+from .ctp.tick_archive import read_archive
+
 
 class CtpDataSource(BaseDataSource):
-    def __init__(self, env, md_gateway, trade_gateway):
+    def __init__(self, env, md_gateway, trade_gateway, bar_builder=None):
         path = env.config.base.data_bundle_path
         super(CtpDataSource, self).__init__(path)
         self._md_gateway = md_gateway
-        self._md_gateway = trade_gateway
+        self._trade_gateway = trade_gateway
+        self._bar_builder = bar_builder
+
+    def _live_frequencies(self):
+        if self._bar_builder is None:
+            return ['tick']
+        return ['tick'] + list(self._bar_builder.frequencies)
+
+    def get_bar(self, instrument, dt, frequency):
+        if self._bar_builder is None or frequency not in self._bar_builder.frequencies:
+            return super(CtpDataSource, self).get_bar(instrument, dt, frequency)
+        bar = self._bar_builder.get_bar(instrument.order_book_id, frequency)
+        if bar is None:
+            return None
+        return dict(zip(bar.dtype.names, bar.item()))
 
     def current_snapshot(self, instrument, frequency, dt):
-        if frequency != 'tick':
+        if frequency not in self._live_frequencies():
             raise NotImplementedError
 
         order_book_id = instrument.order_book_id
@@ -38,8 +54,26 @@ class CtpDataSource(BaseDataSource):
             system_log.error('Cannot find such tick whose order_book_id is {} ', order_book_id)
         return SnapshotObject(instrument, tick_snapshot, dt)
 
+    def history_ticks(self, order_book_id, n):
+        """
+        返回合约最近 n 个 tick，为 TICK_HISTORY_DTYPE 的只读数组视图，按时间先后排列。需要开启 event.tick_history。
+        """
+        tick_history = self._md_gateway.tick_history
+        if tick_history is None:
+            raise RuntimeError('未开启 tick 历史缓存，请设置 event.tick_history')
+        return tick_history.last(order_book_id, n)
+
+    def archived_ticks(self, order_book_id, trading_date):
+        """
+        以 np.memmap 方式读取 event.archive_path 中归档的某交易日全部 tick，为 SNAPSHOT_DTYPE 的只读数组。
+        """
+        archive = self._md_gateway.archive
+        if archive is None:
+            raise RuntimeError('未开启 tick 归档，请设置 event.archive_path')
+        return read_archive(archive.root, int(trading_date.strftime('%Y%m%d')), order_book_id)
+
     def available_data_range(self, frequency):
-        if frequency != 'tick':
+        if frequency not in self._live_frequencies():
             raise NotImplementedError
         s = date.today()
         e = date.fromtimestamp(2147483647)
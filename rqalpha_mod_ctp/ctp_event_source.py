@@ -16,132 +16,194 @@
 # limitations under the License.
 
 from datetime import timedelta, datetime, date
-from dateutil.parser import parse
-from threading import Thread
-from enum import Enum
 
 from rqalpha.utils.logger import system_log
 from rqalpha.interface import AbstractEventSource
 from rqalpha.events import Event, EVENT
 from rqalpha.utils import RqAttrDict
+from rqalpha.environment import Environment
 
+from .clock import RealClock
+from .const import CTP_EVENT
+from .trading_session import TimePeriod, TickDatetimeDecoder, build_timeline, seconds_until
 
-class TimePeriod(Enum):
-    BEFORE_TRADING = 'before_trading'
-    AFTER_TRADING = 'after_trading'
-    TRADING = 'trading'
-    CLOSING = 'closing'
+
+# 非交易时段内单次休眠的最长时间（秒），避免系统挂起等情况导致错过时段边界过久
+MAX_IDLE_SLEEP = 60
 
 
 # TODO: 目前只考虑了期货的场景
 class CtpEventSource(AbstractEventSource):
-    def __init__(self, env, mod_config, md_gateway):
+    def __init__(self, env, mod_config, md_gateway, session_table=None, bar_builder=None, clock=None):
         self._env = env
+        self._clock = clock if clock is not None else RealClock()
         self._mod_config = mod_config
         self._md_gateway = md_gateway
+        self._session_table = session_table
+        self._bar_builder = bar_builder
+        self._dt_decoder = TickDatetimeDecoder(env.data_proxy.get_previous_trading_date,
+                                               env.data_proxy.get_next_trading_date)
+        self._ignore_action_day = {}
         self._before_trading_processed = False
         self._after_trading_processed = False
         self._time_period = None
 
-    def mark_time_period(self, start_date, end_date):
-        trading_days = self._env.data_proxy.get_trading_dates(start_date, end_date)
-
-        def in_before_trading_time(time):
-            if self._mod_config.all_day:
-                return True
-
-            return time.hour == 20 and time.minute < 55
-
-        def in_after_trading(time):
-            if self._mod_config.all_day:
-                return True
-
-            return (time.hour == 15 and time.minute >= 30) or time.hour == 16
-
-        def in_trading_time(time):
-            if self._mod_config.event.all_day:
-                return True
-
-            if time.hour < 15 or time.hour >= 21:
-                return True
-            elif time.hour == 20 and time.minute >= 55:
-                return True
-            elif time.hour == 15 and time.minute < 30:
-                return True
-            else:
-                return False
-
-        def in_trading_day(time):
-            if self._mod_config.all_day:
-                return True
-
-            if time.hour < 20:
-                if time.date() in trading_days:
-                    return True
-            else:
-                if (time + timedelta(days=1)).date() in trading_days:
-                    return True
-            return False
-
-        while True:
-            now = datetime.now()
-            if in_trading_time(now):
-                self._time_period = TimePeriod.TRADING
-                continue
-            if not in_trading_day(now):
-                self._time_period = TimePeriod.CLOSING
-                continue
-            if in_before_trading_time(now):
-                self._time_period = TimePeriod.BEFORE_TRADING
-                continue
-            if in_after_trading(now):
-                self._time_period = TimePeriod.AFTER_TRADING
-                continue
-            else:
-                self._time_period = TimePeriod.CLOSING
-
     def events(self, start_date, end_date, frequency):
+        timeline = build_timeline(
+            self._env.data_proxy, start_date, date.fromtimestamp(2147483647), self._mod_config.event.all_day
+        )
 
-        if not self._mod_config.event.all_day:
-            while datetime.now().date() < start_date - timedelta(days=1):
-                continue
-
-        mark_time_thread = Thread(target=self.mark_time_period, args=(start_date, date.fromtimestamp(2147483647)))
-        mark_time_thread.setDaemon(True)
-        mark_time_thread.start()
         while True:
+            now = self._clock.now()
+            self._time_period, next_boundary = timeline.period_at(now)
             if self._time_period == TimePeriod.BEFORE_TRADING:
                 if self._after_trading_processed:
                     self._after_trading_processed = False
                 if not self._before_trading_processed:
                     system_log.debug("CtpEventSource: before trading event")
-                    yield Event(EVENT.BEFORE_TRADING, calendar_dt=datetime.now(), trading_dt=datetime.now() + timedelta(days=1))
+                    yield Event(EVENT.BEFORE_TRADING, calendar_dt=self._clock.now(), trading_dt=self._clock.now() + timedelta(days=1))
                     self._before_trading_processed = True
                     continue
                 else:
-                    continue
+                    self._clock.sleep(seconds_until(now, next_boundary, MAX_IDLE_SLEEP))
             elif self._time_period == TimePeriod.TRADING:
                 if not self._before_trading_processed:
                     system_log.debug("CtpEventSource: before trading event")
-                    yield Event(EVENT.BEFORE_TRADING, calendar_dt=datetime.now(), trading_dt=datetime.now() + timedelta(days=1))
+                    yield Event(EVENT.BEFORE_TRADING, calendar_dt=self._clock.now(), trading_dt=self._clock.now() + timedelta(days=1))
                     self._before_trading_processed = True
                     continue
                 else:
-                    tick = self._md_gateway.get_tick()
-                    dt_str = ''.join((str(tick.date), str(float(tick.time) / 1000))) if tick.time >= 100000000 else '0'.join((str(tick.date), str(float(tick.time) / 1000)))
-                    calendar_dt = parse(dt_str.split('.')[0]) + timedelta(milliseconds=100 * int(dt_str.split('.')[1]))
-                    if calendar_dt.hour > 20:
-                        trading_dt = calendar_dt + timedelta(days=1)
-                    else:
-                        trading_dt = calendar_dt
-                    system_log.debug("CtpEventSource: tick {}", tick)
-                    yield Event(EVENT.TICK, calendar_dt=calendar_dt, trading_dt=trading_dt, tick=RqAttrDict(tick))
+                    for gap in self._md_gateway.pop_gap_events():
+                        yield Event(CTP_EVENT.MD_RECONNECTED, calendar_dt=self._clock.now(), gap=gap)
+                    timeout = seconds_until(now, next_boundary)
+                    if self._bar_builder is not None:
+                        timeout = seconds_until(now, self._bar_builder.next_flush_time(), timeout)
+                    ticks = self._fetch_ticks(self._clock.to_real(timeout))
+                    for event in self._tick_events(ticks):
+                        yield event
+                    if not ticks:
+                        self._clock.elapse(timeout)
+                    if self._bar_builder is not None:
+                        bar_event = self._flush_bars(self._clock.now())
+                        if bar_event is not None:
+                            yield bar_event
             elif self._time_period == TimePeriod.AFTER_TRADING:
                 if self._before_trading_processed:
                     self._before_trading_processed = False
                 if not self._after_trading_processed:
                     system_log.debug("CtpEventSource: after trading event")
-                    yield Event(EVENT.AFTER_TRADING, calendar_dt=datetime.now(), trading_dt=datetime.now())
+                    yield Event(EVENT.AFTER_TRADING, calendar_dt=self._clock.now(), trading_dt=self._clock.now())
                     self._after_trading_processed = True
                 else:
+                    self._clock.sleep(seconds_until(now, next_boundary, MAX_IDLE_SLEEP))
+            else:
+                self._clock.sleep(seconds_until(now, next_boundary, MAX_IDLE_SLEEP))
+
+    def _tick_events(self, ticks):
+        latency = self._md_gateway.latency
+        bar_builder = self._bar_builder
+        # LazyTickDict 直接交给策略，转换成 RqAttrDict 会解码全部字段
+        lazy_tick = self._mod_config.event.lazy_tick
+        for tick in ticks:
+            if not self._in_session(tick):
+                system_log.debug("CtpEventSource: drop tick out of session {}", tick)
+                continue
+            calendar_dt, trading_dt = self._decode_dt(tick)
+            if bar_builder is not None:
+                bar_builder.update(tick, calendar_dt, trading_dt)
+                continue
+            system_log.debug("CtpEventSource: tick {}", tick)
+            if latency is not None:
+                latency.on_dispatch(tick)
+            yield Event(EVENT.TICK, calendar_dt=calendar_dt, trading_dt=trading_dt,
+                        tick=tick if lazy_tick else RqAttrDict(tick.as_dict()))
+            if latency is not None:
+                latency.on_handled(tick)
+
+    def _flush_bars(self, now):
+        bar_dt = self._bar_builder.flush(now)
+        if bar_dt is None:
+            return None
+        system_log.debug("CtpEventSource: bar {}", bar_dt[0])
+        return Event(EVENT.BAR, calendar_dt=bar_dt[0], trading_dt=bar_dt[1])
+
+    def _fetch_ticks(self, timeout):
+        batch_size = self._mod_config.event.batch_size
+        if batch_size > 1:
+            return self._md_gateway.get_ticks(batch_size, timeout, self._mod_config.event.batch_wait)
+        tick = self._md_gateway.get_tick(timeout)
+        return (tick, ) if tick is not None else ()
+
+    def _is_dce(self, order_book_id):
+        try:
+            ins_dict = Environment.get_ins_dict(order_book_id)
+            if ins_dict is not None:
+                return ins_dict.exchange_id == 'DCE'
+        except AttributeError:
+            pass
+        try:
+            return self._env.get_instrument(order_book_id).exchange in ('DCE', 'XDCE')
+        except (AttributeError, KeyError, ValueError):
+            return False
+
+    def _decode_dt(self, tick):
+        # 大商所夜盘的 ActionDay 为交易日，不能作为自然日使用
+        order_book_id = tick.order_book_id
+        try:
+            ignore_action_day = self._ignore_action_day[order_book_id]
+        except KeyError:
+            ignore_action_day = self._ignore_action_day[order_book_id] = self._is_dce(order_book_id)
+        return self._dt_decoder.decode(tick.date, tick.time, None if ignore_action_day else tick.action_day)
+
+    def _in_session(self, tick):
+        if self._session_table is None or self._mod_config.event.all_day:
+            return True
+        return self._session_table.in_session_at(tick.order_book_id, tick.time)
+
+
+class ReplayEventSource(CtpEventSource):
+    """
+    回放行情日志的事件源，md_gateway 须为 ReplayMdGateway。
+
+    tick 经过与 CtpEventSource 相同的处理流程产出事件；交易日以解码后 trading_dt 的日期划分并且只向后切换，
+    各交易所夜盘 TradingDay 的含义不同，不能直接比较。交易日切换时产出 after_trading 与 before_trading 事件，
+    日志回放完毕后事件源结束。
+    """
+    def events(self, start_date, end_date, frequency):
+        self._md_gateway.start()
+        trading_day = None
+        last_dts = None
+        while True:
+            ticks = self._fetch_ticks(1)
+            if not ticks:
+                if self._md_gateway.finished and self._md_gateway.pending_ticks() == 0:
+                    break
+                continue
+
+            start = 0
+            for i, tick in enumerate(ticks):
+                calendar_dt, trading_dt = self._decode_dt(tick)
+                if trading_day is not None and trading_dt.date() <= trading_day:
                     continue
+                for event in self._tick_events(ticks[start:i]):
+                    yield event
+                start = i
+                if trading_day is not None:
+                    yield Event(EVENT.AFTER_TRADING, calendar_dt=last_dts[0], trading_dt=last_dts[1])
+                trading_day = trading_dt.date()
+                yield Event(EVENT.BEFORE_TRADING, calendar_dt=calendar_dt, trading_dt=trading_dt)
+            for event in self._tick_events(ticks[start:]):
+                yield event
+
+            last_dts = self._decode_dt(ticks[-1])
+            if self._bar_builder is not None:
+                bar_event = self._flush_bars(last_dts[0])
+                if bar_event is not None:
+                    yield bar_event
+
+        if trading_day is not None:
+            if self._bar_builder is not None:
+                bar_event = self._flush_bars(datetime.max - timedelta(days=1))
+                if bar_event is not None:
+                    yield bar_event
+            yield Event(EVENT.AFTER_TRADING, calendar_dt=last_dts[0], trading_dt=last_dts[1])
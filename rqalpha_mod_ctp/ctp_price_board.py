@@ -15,6 +15,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
+
 from rqalpha.interface import AbstractPriceBoard
 from rqalpha.utils.logger import system_log
 
@@ -25,24 +27,41 @@ class CtpPriceBoard(AbstractPriceBoard):
         self._trade_gateway = trade_gateway
 
     def get_last_price(self, order_book_id):
-        tick_snapshot = self._md_gateway.snapshot.get(order_book_id)
-        if tick_snapshot is None:
-            tick_snapshot = self._trade_gateway.snapshot.get(order_book_id)
+        last = self._md_gateway.snapshot.get_value(order_book_id, 'last')
+        # 由行情查询预填、尚未成交的合约最新价为 nan，与 get_last_prices 一样改取持仓中的价格
+        if last is not None and not np.isnan(last):
+            return last
+        tick_snapshot = self._trade_gateway.snapshot.get(order_book_id)
         if tick_snapshot is None:
             system_log.error('Cannot find such tick whose order_book_id is {} ', order_book_id)
             return
         return tick_snapshot['last']
 
     def get_limit_up(self, order_book_id):
-        tick_snapshot = self._md_gateway.snapshot.get(order_book_id)
-        if tick_snapshot is None:
+        limit_up = self._md_gateway.snapshot.get_value(order_book_id, 'limit_up')
+        if limit_up is None:
             system_log.error('Cannot find such tick whose order_book_id is {} ', order_book_id)
-            return
-        return tick_snapshot['limit_up']
+        return limit_up
 
     def get_limit_down(self, order_book_id):
-        tick_snapshot = self._md_gateway.snapshot.get(order_book_id)
-        if tick_snapshot is None:
+        limit_down = self._md_gateway.snapshot.get_value(order_book_id, 'limit_down')
+        if limit_down is None:
             system_log.error('Cannot find such tick whose order_book_id is {} ', order_book_id)
-            return
-        return tick_snapshot['limit_down']
+        return limit_down
+
+    def get_last_prices(self, order_book_ids):
+        """
+        批量获取一组合约的最新价，返回 numpy 数组，行情中没有的合约取持仓中的价格，仍然没有的为 nan。
+        """
+        prices = self._md_gateway.snapshot.last_prices(order_book_ids)
+        for i in np.flatnonzero(np.isnan(prices)):
+            tick_snapshot = self._trade_gateway.snapshot.get(order_book_ids[i])
+            if tick_snapshot is not None:
+                prices[i] = tick_snapshot['last']
+        return prices
+
+    def get_limit_ups(self, order_book_ids):
+        return self._md_gateway.snapshot.limit_up(order_book_ids)
+
+    def get_limit_downs(self, order_book_ids):
+        return self._md_gateway.snapshot.limit_down(order_book_ids)
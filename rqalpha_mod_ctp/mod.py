@@ -15,13 +15,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from datetime import datetime, time, timedelta
+
 from rqalpha.interface import AbstractMod
-from .ctp_event_source import CtpEventSource
+from rqalpha.utils.logger import system_log
+from .ctp_event_source import CtpEventSource, ReplayEventSource
 from .ctp_broker import CtpBroker
 from .ctp_data_source import CtpDataSource
 from .ctp_price_board import CtpPriceBoard
+from .bar_builder import BarBuilder
+from .clock import make_clock
 
-from .ctp.md_gateway import MdGateway
+from .ctp.md_gateway import MdGateway, ReplayMdGateway
 from .ctp.trade_gateway import TradeGateway
 
 
@@ -42,16 +47,38 @@ class CtpMod(AbstractMod):
 
         if mod_config.event.enabled:
             self._init_md_gateway()
-            self._env.set_event_source(CtpEventSource(env, mod_config, self._md_gateway))
-            self._env.set_data_source(CtpDataSource(env, self._md_gateway, self._trade_gateway))
+            session_table = self._trade_gateway.session_table if self._trade_gateway is not None else None
+            bar_builder = BarBuilder(session_table=session_table) if env.config.base.frequency == '1m' else None
+            event_source_cls = ReplayEventSource if mod_config.event.replay_path else CtpEventSource
+            clock = make_clock(mod_config.event.clock, self._clock_start(), mod_config.event.clock_speed)
+            self._env.set_event_source(
+                event_source_cls(env, mod_config, self._md_gateway, session_table, bar_builder, clock))
+            self._env.set_data_source(CtpDataSource(env, self._md_gateway, self._trade_gateway, bar_builder))
             self._env.set_price_board(CtpPriceBoard(self._md_gateway, self._trade_gateway))
 
     def tear_down(self, code, exception=None):
         if self._md_gateway is not None:
+            if self._md_gateway.latency is not None:
+                system_log.info('tick 延迟统计：\n{}', self._md_gateway.latency.format_summary())
+            rejected = self._md_gateway.rejected_ticks
+            if rejected['duplicates'] or rejected['regressions']:
+                system_log.info('丢弃的重复 tick：{}，乱序 tick：{}', rejected['duplicates'], rejected['regressions'])
+            reconnect_stats = self._md_gateway.reconnect_stats
+            if reconnect_stats['disconnects']:
+                system_log.info('行情断线 {} 次，行情中断共 {:.1f} 秒', reconnect_stats['disconnects'],
+                                reconnect_stats['total_gap_seconds'])
+            front_stats = self._md_gateway.front_stats
+            if len(front_stats) > 1:
+                system_log.info('行情前置统计：{}', front_stats)
             self._md_gateway.exit()
         if self._trade_gateway is not None:
             self._trade_gateway.exit()
 
+    def _clock_start(self):
+        # 非实时时钟从 start_date 前一天 19:00 开始走，以便依次经过盘前、夜盘、日盘和盘后
+        start_date = self._env.config.base.start_date
+        return datetime.combine(start_date, time()) - timedelta(hours=5)
+
     def _init_trade_gateway(self):
         if not self._mod_config.trade.enabled:
             return
@@ -60,7 +87,8 @@ class CtpMod(AbstractMod):
         broker_id = self._mod_config.login.broker_id
         trade_frontend_uri = self._mod_config.trade.address
 
-        self._trade_gateway = TradeGateway(self._env)
+        self._trade_gateway = TradeGateway(self._env, query_rate=self._mod_config.trade.query_rate,
+                                           query_burst=self._mod_config.trade.query_burst)
         self._trade_gateway.connect(user_id, password, broker_id, trade_frontend_uri)
 
     def _init_md_gateway(self):
@@ -70,7 +98,28 @@ class CtpMod(AbstractMod):
         password = self._mod_config.login.password
         broker_id = self._mod_config.login.broker_id
         md_frontend_uri = self._mod_config.event.address
+        event_config = self._mod_config.event
 
-        self._md_gateway = MdGateway(self._env)
+        if event_config.replay_path:
+            self._md_gateway = ReplayMdGateway(self._env, event_config.replay_path, event_config.replay_speed,
+                                               conflate=event_config.conflate,
+                                               latency_stats=event_config.latency_stats,
+                                               tick_history=event_config.tick_history,
+                                               archive_path=event_config.archive_path,
+                                               dedup=event_config.dedup,
+                                               lazy_tick=event_config.lazy_tick)
+        else:
+            self._md_gateway = MdGateway(self._env, conflate=event_config.conflate,
+                                         latency_stats=event_config.latency_stats,
+                                         record_path=event_config.record_path,
+                                         always_subscribe=event_config.always_subscribe,
+                                         tick_history=event_config.tick_history,
+                                         archive_path=event_config.archive_path,
+                                         dedup=event_config.dedup,
+                                         reconnect_event=event_config.reconnect_event,
+                                         lazy_tick=event_config.lazy_tick)
+            if self._trade_gateway is not None:
+                # 在订阅行情之前预填，查询结果不会覆盖更新的行情推送
+                self._md_gateway.seed_snapshot(self._trade_gateway.depth_market_data)
         self._md_gateway.connect(user_id, password, broker_id, md_frontend_uri)
 
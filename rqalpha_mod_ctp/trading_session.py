@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2017 Ricequant, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from enum import Enum
+from six import string_types
+
+
+class TimePeriod(Enum):
+    BEFORE_TRADING = 'before_trading'
+    AFTER_TRADING = 'after_trading'
+    TRADING = 'trading'
+    CLOSING = 'closing'
+
+
+BEFORE_TRADING_START = time(20, 0)
+TRADING_START = time(20, 55)
+AFTER_TRADING_START = time(15, 30)
+AFTER_TRADING_END = time(17, 0)
+
+
+class SessionTimeline(object):
+    """
+    预先计算好的交易时段时间线。
+
+    对每个交易日 T（其上一交易日为 P），时段边界为：
+        P 20:00 BEFORE_TRADING -> P 20:55 TRADING -> T 15:30 AFTER_TRADING -> T 17:00 CLOSING
+    其余时间均为 CLOSING。查询当前时段及下一个边界只需一次二分查找。
+    """
+    def __init__(self, trading_dates, prev_trading_date):
+        self._boundaries = []
+        self._periods = []
+
+        prev_date = prev_trading_date
+        for trading_date in trading_dates:
+            self._append(datetime.combine(prev_date, BEFORE_TRADING_START), TimePeriod.BEFORE_TRADING)
+            self._append(datetime.combine(prev_date, TRADING_START), TimePeriod.TRADING)
+            self._append(datetime.combine(trading_date, AFTER_TRADING_START), TimePeriod.AFTER_TRADING)
+            self._append(datetime.combine(trading_date, AFTER_TRADING_END), TimePeriod.CLOSING)
+            prev_date = trading_date
+
+    def _append(self, boundary, period):
+        self._boundaries.append(boundary)
+        self._periods.append(period)
+
+    def period_at(self, dt):
+        """
+        返回 dt 所处的时段以及下一个时段边界，超出时间线范围时下一个边界为 None。
+        """
+        i = bisect_right(self._boundaries, dt)
+        period = self._periods[i - 1] if i > 0 else TimePeriod.CLOSING
+        next_boundary = self._boundaries[i] if i < len(self._boundaries) else None
+        return period, next_boundary
+
+
+class AllDayTimeline(object):
+    """
+    all_day 模式下的时间线，任何时刻都处于交易时段。
+    """
+    @staticmethod
+    def period_at(dt):
+        return TimePeriod.TRADING, None
+
+
+def seconds_until(now, boundary, cap=None):
+    if boundary is None:
+        return cap
+    seconds = (boundary - now).total_seconds()
+    if cap is not None:
+        seconds = min(seconds, cap)
+    return max(seconds, 0)
+
+
+def build_timeline(data_proxy, start_date, end_date, all_day=False):
+    if all_day:
+        return AllDayTimeline()
+    trading_dates = [d.date() for d in data_proxy.get_trading_dates(start_date, end_date)]
+    if not trading_dates:
+        return SessionTimeline([], start_date)
+    prev_trading_date = data_proxy.get_previous_trading_date(trading_dates[0])
+    if hasattr(prev_trading_date, 'date'):
+        prev_trading_date = prev_trading_date.date()
+    return SessionTimeline(trading_dates, prev_trading_date)
+
+
+# 各品种日盘交易时段，(开始, 结束, 是否包含开盘集合竞价)
+COMMODITY_DAY_SESSIONS = ((time(9, 0), time(10, 15), True), (time(10, 30), time(11, 30), False),
+                          (time(13, 30), time(15, 0), False))
+INDEX_FUTURE_DAY_SESSIONS = ((time(9, 30), time(11, 30), True), (time(13, 0), time(15, 0), False))
+BOND_FUTURE_DAY_SESSIONS = ((time(9, 15), time(11, 30), True), (time(13, 0), time(15, 15), False))
+
+CFFEX_DAY_SESSIONS = {
+    'IF': INDEX_FUTURE_DAY_SESSIONS,
+    'IH': INDEX_FUTURE_DAY_SESSIONS,
+    'IC': INDEX_FUTURE_DAY_SESSIONS,
+    'T': BOND_FUTURE_DAY_SESSIONS,
+    'TF': BOND_FUTURE_DAY_SESSIONS,
+    'TS': BOND_FUTURE_DAY_SESSIONS,
+}
+
+NIGHT_SESSION_START = time(21, 0)
+
+# 各品种夜盘结束时间，仅在拿不到合约的 trading_hours 时使用。CFFEX 以外不在表中的品种视为全天处于交易时段
+NIGHT_SESSION_END = {
+    # 上期所
+    'CU': time(1, 0), 'AL': time(1, 0), 'ZN': time(1, 0), 'PB': time(1, 0), 'NI': time(1, 0), 'SN': time(1, 0),
+    'AU': time(2, 30), 'AG': time(2, 30),
+    'RB': time(23, 0), 'HC': time(23, 0), 'BU': time(23, 0), 'RU': time(23, 0),
+    # 上期能源
+    'SC': time(2, 30),
+    # 大商所
+    'A': time(23, 0), 'B': time(23, 0), 'M': time(23, 0), 'Y': time(23, 0), 'P': time(23, 0),
+    'J': time(23, 0), 'JM': time(23, 0), 'I': time(23, 0),
+    # 郑商所
+    'SR': time(23, 0), 'CF': time(23, 0), 'RM': time(23, 0), 'MA': time(23, 0), 'TA': time(23, 0),
+    'ZC': time(23, 0), 'FG': time(23, 0), 'OI': time(23, 0), 'CY': time(23, 0),
+}
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minute_of(t):
+    return t.hour * 60 + t.minute
+
+
+def _mark(flags, start, end, auction):
+    # 开盘前一分钟为集合竞价，收盘所在的那一分钟仍会推送收盘行情，均视为交易时段内
+    begin = _minute_of(start) - 1 if auction else _minute_of(start)
+    stop = _minute_of(end)
+    minute = begin
+    while True:
+        flags[minute % MINUTES_PER_DAY] = 1
+        if minute % MINUTES_PER_DAY == stop:
+            break
+        minute += 1
+
+
+def _time_of(minute):
+    return time(*divmod(minute % MINUTES_PER_DAY, 60))
+
+
+def _parse_trading_hours(trading_hours):
+    """
+    解析 rqalpha Instrument.trading_hours，可以是 '21:01-23:00,09:01-10:15,...' 形式的字符串，也可以是带 start/end 的
+    TimeRange 列表。其中的开始时间为开盘后第一根分钟线的时间，因此实际开盘时间要提前一分钟；第一个时段前有集合竞价。
+    """
+    if isinstance(trading_hours, string_types):
+        ranges = []
+        for item in trading_hours.split(','):
+            start, end = (time(*(int(i) for i in t.split(':'))) for t in item.strip().split('-'))
+            ranges.append((start, end))
+    else:
+        ranges = [(r.start, r.end) for r in trading_hours]
+    return tuple((_time_of(_minute_of(start) - 1), end, i == 0) for i, (start, end) in enumerate(ranges))
+
+
+def sessions_of(underlying_symbol, exchange_id, trading_hours=None):
+    """
+    返回品种的交易时段 ((开始, 结束, 是否包含开盘集合竞价), ...)，无法确定时返回 None。
+
+    优先使用合约的 trading_hours；没有时按内置的交易时段表，其中 CFFEX 以外的品种只有在 NIGHT_SESSION_END
+    中有记录时才能确定交易时段。
+    """
+    if trading_hours:
+        return _parse_trading_hours(trading_hours)
+    if exchange_id == 'CFFEX':
+        return tuple(CFFEX_DAY_SESSIONS.get(underlying_symbol, INDEX_FUTURE_DAY_SESSIONS))
+    night_end = NIGHT_SESSION_END.get(underlying_symbol)
+    if night_end is None:
+        return None
+    # 有夜盘的品种只在夜盘开盘前集合竞价
+    sessions = [(start, end, False) for start, end, _ in COMMODITY_DAY_SESSIONS]
+    sessions.append((NIGHT_SESSION_START, night_end, True))
+    return tuple(sessions)
+
+
+def compile_sessions(sessions):
+    """
+    将交易时段编译为按分钟索引的标志位表。
+    """
+    flags = bytearray(MINUTES_PER_DAY)
+    for start, end, auction in sessions:
+        _mark(flags, start, end, auction)
+    return flags
+
+
+def compile_bar_minutes(sessions):
+    """
+    生成分钟线归属表：集合竞价那一分钟的 tick 并入开盘后第一根分钟线，收盘那一分钟的 tick 并入收盘前最后一根分钟线。
+    """
+    bar_minutes = list(range(MINUTES_PER_DAY))
+    for start, end, auction in sessions:
+        if auction:
+            bar_minutes[(_minute_of(start) - 1) % MINUTES_PER_DAY] = _minute_of(start)
+        bar_minutes[_minute_of(end)] = (_minute_of(end) - 1) % MINUTES_PER_DAY
+    return bar_minutes
+
+
+class SessionTable(object):
+    """
+    按合约区分的交易时段表。get_trading_hours(order_book_id) 返回合约的 trading_hours（见 sessions_of），
+    拿不到时按品种使用内置的交易时段。
+
+    交易时段相同的合约共享同一张分钟标志位表，判断某合约在某时刻是否处于交易时段只需一次字典查找和一次下标访问。
+    未知合约以及无法确定交易时段的品种一律视为处于交易时段内。
+    """
+    def __init__(self, ins_dicts=(), get_trading_hours=None):
+        self._flags = {}
+        self._bar_minutes = {}
+        compiled = {}
+        for ins_dict in ins_dicts:
+            trading_hours = get_trading_hours(ins_dict.order_book_id) if get_trading_hours is not None else None
+            sessions = sessions_of(ins_dict.underlying_symbol, ins_dict.exchange_id, trading_hours)
+            if sessions is None:
+                continue
+            if sessions not in compiled:
+                compiled[sessions] = compile_sessions(sessions), compile_bar_minutes(sessions)
+            self._flags[ins_dict.order_book_id], self._bar_minutes[ins_dict.order_book_id] = compiled[sessions]
+
+    def in_session(self, order_book_id, dt):
+        flags = self._flags.get(order_book_id)
+        if flags is None:
+            return True
+        return flags[dt.hour * 60 + dt.minute] == 1
+
+    def in_session_at(self, order_book_id, tick_time):
+        """
+        tick_time 为 TickDict.time 格式的整数 HHMMSSmmm。
+        """
+        flags = self._flags.get(order_book_id)
+        if flags is None:
+            return True
+        return flags[tick_time // 10000000 * 60 + tick_time // 100000 % 100] == 1
+
+    def bar_minutes(self, order_book_id):
+        """
+        返回合约的分钟线归属表（见 compile_bar_minutes），未知合约返回 None。
+        """
+        return self._bar_minutes.get(order_book_id)
+
+
+def _date_of(day):
+    return date(day // 10000, day // 100 % 100, day % 100)
+
+
+def _as_date(d):
+    return d.date() if hasattr(d, 'date') else d
+
+
+class TickDatetimeDecoder(object):
+    """
+    将 tick 的 TradingDay、ActionDay 与 HHMMSSmmm 格式的时间解码为 (calendar_dt, trading_dt)。
+
+    各交易所夜盘填写日期的方式不同：上期所、能源中心、中金所的 TradingDay 为交易日、ActionDay 为自然日；
+    大商所夜盘的 ActionDay 也是交易日；郑商所夜盘的 TradingDay 则是自然日。因此：
+
+    * 传入 action_day 时（大商所以外），自然日取 ActionDay；夜盘 TradingDay 与 ActionDay 相同时说明 TradingDay
+      实际为自然日，交易日取其下一交易日。
+    * 未传入 action_day 时（大商所），交易日取 TradingDay，夜盘的自然日取上一交易日（周五夜盘对应周一交易日），
+      凌晨则为其后一天。
+
+    零点按日期组合缓存，之后每个 tick 只需整数运算和一次 datetime 加法。
+    """
+    def __init__(self, get_previous_trading_date, get_next_trading_date=None):
+        self._get_previous_trading_date = get_previous_trading_date
+        self._get_next_trading_date = get_next_trading_date
+        self._midnights = {}
+        self._action_midnights = {}
+
+    def _compute_midnights(self, trading_day):
+        trading_date = _date_of(trading_day)
+        prev_trading_date = _as_date(self._get_previous_trading_date(trading_date))
+        night_midnight = datetime.combine(prev_trading_date, time())
+        return datetime.combine(trading_date, time()), night_midnight, night_midnight + timedelta(days=1)
+
+    def _compute_action_midnights(self, trading_day, action_day, night):
+        action_date = _date_of(action_day)
+        if night and trading_day == action_day and self._get_next_trading_date is not None:
+            trading_date = _as_date(self._get_next_trading_date(action_date))
+        else:
+            trading_date = _date_of(trading_day)
+        return datetime.combine(action_date, time()), datetime.combine(trading_date, time())
+
+    def decode(self, trading_day, tick_time, action_day=None):
+        hour = tick_time // 10000000
+        offset = timedelta(0, hour * 3600 + tick_time // 100000 % 100 * 60 + tick_time // 1000 % 100,
+                           0, tick_time % 1000)
+        if action_day:
+            key = (trading_day, action_day, hour >= 18)
+            try:
+                calendar_midnight, trading_midnight = self._action_midnights[key]
+            except KeyError:
+                calendar_midnight, trading_midnight = self._action_midnights[key] = \
+                    self._compute_action_midnights(*key)
+            return calendar_midnight + offset, trading_midnight + offset
+
+        try:
+            trading_midnight, night_midnight, after_midnight = self._midnights[trading_day]
+        except KeyError:
+            trading_midnight, night_midnight, after_midnight = self._midnights[trading_day] = \
+                self._compute_midnights(trading_day)
+
+        if hour >= 18:
+            calendar_dt = night_midnight + offset
+        elif hour < 8:
+            calendar_dt = after_midnight + offset
+        else:
+            calendar_dt = trading_midnight + offset
+        return calendar_dt, trading_midnight + offset
@@ -17,6 +17,12 @@
 import six
 import re
 import platform
+from collections import namedtuple
+from six.moves import intern
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
 
 from rqalpha.environment import Environment
 from rqalpha.const import POSITION_EFFECT, COMMISSION_TYPE
@@ -47,15 +53,15 @@ def bytes2str(obj):
             return obj
 
 
-def make_underlying_symbol(id_or_symbol):
-    id_or_symbol = bytes2str(id_or_symbol)
-    if six.PY2:
-        return filter(lambda x: x not in '0123456789 ', id_or_symbol).upper()
-    else:
-        return ''.join(list(filter(lambda x: x not in '0123456789 ', 'rb1705'))).upper()
+_NON_SYMBOL_CHARS = re.compile('[0-9 ]')
+_FUTURE_PATTERN = re.compile('^[a-zA-Z]+[0-9]+$')
 
 
-def make_order_book_id(symbol):
+def _parse_underlying_symbol(id_or_symbol):
+    return _NON_SYMBOL_CHARS.sub('', bytes2str(id_or_symbol)).upper()
+
+
+def _parse_order_book_id(symbol):
     symbol = bytes2str(symbol)
     if len(symbol) < 4:
         return None
@@ -66,6 +72,66 @@ def make_order_book_id(symbol):
     return order_book_id.upper()
 
 
+SymbolInfo = namedtuple('SymbolInfo', [
+    'order_book_id', 'underlying_symbol', 'exchange_id', 'contract_multiplier', 'instrument_id'
+])
+
+
+class SymbolRegistry(object):
+    """
+    CTP 合约代码（行情、回报中的 InstrumentID，bytes 或 str）到 order_book_id、品种、交易所和合约乘数的查找表，
+    也可以由 order_book_id 反查 CTP 合约代码（SymbolInfo.instrument_id，与行情中的 InstrumentID 类型相同）。
+
+    TradeGateway 查询到合约列表后逐个登记；未登记的合约代码在第一次查找时解析一次并缓存，交易所与合约乘数为 None。
+    """
+    def __init__(self):
+        self._symbols = {}
+        self._order_book_ids = {}
+
+    def register(self, instrument_id, order_book_id, underlying_symbol, exchange_id, contract_multiplier):
+        order_book_id = intern(str(order_book_id))
+        info = SymbolInfo(order_book_id, intern(str(underlying_symbol)), exchange_id, contract_multiplier,
+                          str2bytes(instrument_id))
+        self._symbols[instrument_id] = info
+        # 同时登记另一种类型的合约代码，bytes 与 str 都能一次查到
+        self._symbols[str2bytes(instrument_id) if isinstance(instrument_id, six.text_type)
+                      else bytes2str(instrument_id)] = info
+        self._order_book_ids[order_book_id] = info
+        return info
+
+    def lookup(self, instrument_id):
+        try:
+            return self._symbols[instrument_id]
+        except KeyError:
+            pass
+        order_book_id = _parse_order_book_id(instrument_id)
+        info = SymbolInfo(
+            intern(order_book_id) if order_book_id is not None else None,
+            intern(_parse_underlying_symbol(instrument_id)), None, None, str2bytes(instrument_id)
+        )
+        self._symbols[instrument_id] = info
+        if order_book_id is not None:
+            self._order_book_ids.setdefault(info.order_book_id, info)
+        return info
+
+    def get(self, order_book_id):
+        """
+        由 order_book_id 查找已登记或已见过的合约，找不到时返回 None。
+        """
+        return self._order_book_ids.get(order_book_id)
+
+
+symbol_registry = SymbolRegistry()
+
+
+def make_underlying_symbol(id_or_symbol):
+    return symbol_registry.lookup(id_or_symbol).underlying_symbol
+
+
+def make_order_book_id(symbol):
+    return symbol_registry.lookup(symbol).order_book_id
+
+
 def cal_commission(trade_dict, position_effect):
     order_book_id = trade_dict.order_book_id
     env = Environment.get_instance()
@@ -102,5 +168,5 @@ def is_future(order_book_id):
     order_book_id = bytes2str(order_book_id)
     if order_book_id is None:
         return False
-    return re.match('^[a-zA-Z]+[0-9]+$', order_book_id) is not None
+    return _FUTURE_PATTERN.match(order_book_id) is not None
 